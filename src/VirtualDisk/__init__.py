@@ -1,3 +1,7 @@
 from .__main__ import VirtualDisk
 from .diskError import VirtualDiskError
 from .loop import LoopError
+from .diskInfo import DiskInfo
+from .mountTable import MOUNT_TABLE
+from .loopRegistry import LOOP_REGISTRY
+from .ioLimits import IO_LIMITER
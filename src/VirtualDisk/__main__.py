@@ -7,9 +7,15 @@ from .diskInfo import diskInfo
 from .operations import diskOperations
 
 class VirtualDisk(LoopManager, diskInfo, diskOperations):
-    def __init__(self, disk_image, debug=False):
+    def __init__(self, disk_image, debug=False, filesystem=None, loop_options=None, io_limits=None, mount_options=None):
         self.moduleName = "VirtualDisk"
         self.disk_image = disk_image
         self.disk_image_name = disk_image.replace('.img', '').split("/")[-1]
         self.debug = debug
+        self.loop_devices = []
+        # Тип файловой системы, если он уже известен (например, из сохраненного состояния)
+        self._filesystem = filesystem
+        self.loop_options = loop_options or {}
+        self.io_limits = io_limits or {}
+        self.mount_options = list(mount_options or [])
         self._recover_loop_devices()
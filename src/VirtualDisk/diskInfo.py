@@ -1,77 +1,127 @@
 from shell import Shell
 from .diskError import VirtualDiskError
+from .mountTable import MOUNT_TABLE
 import subprocess
+import time
 import os
 
+class DiskInfo:
+    """Неизменяемый снимок состояния виртуального диска."""
+    __slots__ = ("disk_file", "size_mb", "allocated_mb", "filesystem", "mounted", "mount_points", "usage", "loop", "created_at")
+
+    def __init__(self, disk_file, size_mb, filesystem, mount_points, usage, loop=None, allocated_mb=None):
+        object.__setattr__(self, "disk_file", disk_file)
+        object.__setattr__(self, "size_mb", size_mb)
+        object.__setattr__(self, "allocated_mb", size_mb if allocated_mb is None else allocated_mb)
+        object.__setattr__(self, "filesystem", filesystem)
+        object.__setattr__(self, "mounted", len(mount_points) > 0)
+        object.__setattr__(self, "mount_points", tuple(mount_points))
+        object.__setattr__(self, "usage", usage)
+        object.__setattr__(self, "loop", loop or {})
+        object.__setattr__(self, "created_at", time.monotonic())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DiskInfo is immutable")
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def age(self):
+        return time.monotonic() - self.created_at
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__ if key != "created_at"}
+
 class diskInfo(Shell):
+    # Время жизни снимка get_disk_info (в секундах) - ограничивает устаревание данных об использовании
+    usage_ttl = 5
+    _disk_info = None
+    _filesystem = None
+
     def __init__(self, disk_image, loop_devices):
         self.disk_image = disk_image
         self.disk_image_name = disk_image.replace('.img', '').split("/")[-1]
         self.loop_devices = loop_devices
 
     def _detect_filesystem(self):
-        """Specifies the file system type in the image."""
+        """Specifies the file system type in the image (detected once per image)."""
+        if self._filesystem is not None:
+            return self._filesystem
+
         try:
             result = self._run_command_output(
                 ["blkid", "-o", "value", "-s", "TYPE", self.disk_image],
             )
-            return result.strip() if result else "unknown"
+            fs_type = result.strip() if result else "unknown"
         except subprocess.CalledProcessError:
             return "unknown"
 
+        if fs_type and fs_type != "unknown":
+            self._filesystem = fs_type
+        return fs_type or "unknown"
+
+    def _invalidate_disk_info(self, filesystem=False):
+        """Сбрасывает кэшированный снимок (и тип файловой системы, если он мог измениться)."""
+        self._disk_info = None
+        if filesystem:
+            self._filesystem = None
+
+    def _get_usage(self, mount_point):
+        disk_usage = os.statvfs(mount_point)
+        return {
+            "total_bytes": disk_usage.f_blocks * disk_usage.f_frsize,
+            "used_bytes": (disk_usage.f_blocks - disk_usage.f_bfree) * disk_usage.f_frsize,
+            "free_bytes": disk_usage.f_bavail * disk_usage.f_frsize,
+            "total_gb": (disk_usage.f_blocks * disk_usage.f_frsize) / (1024 ** 3),
+            "used_gb": ((disk_usage.f_blocks - disk_usage.f_bfree) * disk_usage.f_frsize) / (1024 ** 3),
+            "free_gb": (disk_usage.f_bavail * disk_usage.f_frsize) / (1024 ** 3),
+            "use_percent": 100 - (disk_usage.f_bavail / disk_usage.f_blocks * 100)
+        }
+
     def get_disk_info(self):
         """
-        Returns information about the virtual disk:
-        - Image file size (in MB)
+        Returns a cached DiskInfo snapshot of the virtual disk:
+        - Image file size and space allocated for it on the host (in MB)
         - File system
         - Mount points
         - Used and free space (if mounted)
+        - Settings of the attached loop devices
+
+        The snapshot is rebuilt after create/mount/unmount/resize or when
+        it is older than usage_ttl seconds.
         """
+        snapshot = self._disk_info
+        if snapshot is not None and snapshot.age() < self.usage_ttl:
+            return snapshot
+
         if not os.path.exists(self.disk_image):
             raise VirtualDiskError(f"The disk file ({self.disk_image}) does not exist")
 
-        info = {
-            "disk_file": self.disk_image,
-            "size_mb": os.path.getsize(self.disk_image) // (1024 * 1024),
-            "filesystem": self._detect_filesystem(),
-            "mounted": self.is_mounted(),
-            "mount_points": self.get_mount_points(),
-            "usage": {}
-        }
-
-        if info["mounted"]:
-            for mount_point in info["mount_points"]:
-                disk_usage = os.statvfs(mount_point)
-                info["usage"][mount_point] = {
-                    "total_gb": (disk_usage.f_blocks * disk_usage.f_frsize) / (1024 ** 3),
-                    "used_gb": ((disk_usage.f_blocks - disk_usage.f_bfree) * disk_usage.f_frsize) / (1024 ** 3),
-                    "free_gb": (disk_usage.f_bavail * disk_usage.f_frsize) / (1024 ** 3),
-                    "use_percent": 100 - (disk_usage.f_bavail / disk_usage.f_blocks * 100)
-                }
-
-        return info
+        mount_points = self.get_mount_points()
+        stat = os.stat(self.disk_image)
+        snapshot = DiskInfo(
+            disk_file       = self.disk_image,
+            size_mb         = stat.st_size // (1024 * 1024),
+            allocated_mb    = stat.st_blocks * 512 // (1024 * 1024),
+            filesystem      = self._detect_filesystem(),
+            mount_points    = mount_points,
+            usage           = {mount_point: self._get_usage(mount_point) for mount_point in mount_points},
+            loop            = {loop_device: self.loop_settings(loop_device) for loop_device in self.loop_devices}
+        )
+        self._disk_info = snapshot
+        return snapshot
 
     def is_mounted(self):
         """Checks if the disk is mounted (including recovered loop devices)."""
-        if not self.loop_devices:
-            return False
-
-        try:
-            mounts = self._run_command_output(['mount'])
-            return any(dev in mounts for dev in self.loop_devices)
-        except subprocess.CalledProcessError:
-            return False
+        return len(self.get_mount_points()) > 0
 
     def get_mount_points(self):
-        """Returns a list of mount points where the disk can be mounted."""
-        mount_points = []
-        try:
-            output = self._run_command_grep(['mount'], self.disk_image_name)
-            for line in output.splitlines():
-                if self.disk_image_name in line or any(loop_device in line for loop_device in self.loop_devices):
-                    mount_point = line.split()[2]
+        """Returns a list of mount points where the disk image or its loop devices are mounted."""
+        mount_points = MOUNT_TABLE.mount_points_for_file(self.disk_image)
+        for loop_device in self.loop_devices:
+            for mount_point in MOUNT_TABLE.mount_points_for_device(loop_device):
+                if mount_point not in mount_points:
                     mount_points.append(mount_point)
-
-        except subprocess.CalledProcessError:
-            pass
         return mount_points
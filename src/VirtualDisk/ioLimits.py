@@ -0,0 +1,161 @@
+import os
+import threading
+
+class IoLimiter:
+    """Ограничения ввода-вывода шар через cgroup v2 io.max.
+
+    Правила задаются для loop-устройства шары (major:minor) в отдельной
+    cgroup, в которую переносятся процессы smbd. Процессы самого
+    приложения переносятся в листовую cgroup "init", так как cgroup с
+    включенными контроллерами для потомков не может содержать процессы.
+    Поэтому setup() вызывается один раз при запуске, до создания потоков.
+    """
+    KEYS = ("rbps", "wbps", "riops", "wiops")
+
+    def __init__(self, root="/sys/fs/cgroup", group="smbd"):
+        self.root = root
+        self.group_path = os.path.join(root, group)
+        self.lock = threading.Lock()
+        self.enabled = None
+        self.error = None
+        # loop-устройство -> примененные ограничения
+        self.limits = {}
+
+    def _write(self, path, value):
+        with open(path, "w") as f:
+            f.write(value)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    def setup(self):
+        """Подготовка иерархии cgroup (один раз). Возвращает True, если ограничения доступны"""
+        if self.enabled is not None:
+            return self.enabled
+        try:
+            if "io" not in self._read(os.path.join(self.root, "cgroup.controllers")).split():
+                raise OSError("cgroup v2 io controller is not available")
+
+            if "io" not in self._read(os.path.join(self.root, "cgroup.subtree_control")).split():
+                leaf = os.path.join(self.root, "init")
+                os.makedirs(leaf, exist_ok=True)
+                for pid in self._read(os.path.join(self.root, "cgroup.procs")).split():
+                    try:
+                        self._write(os.path.join(leaf, "cgroup.procs"), pid)
+                    except OSError:
+                        # Процесс уже завершился или это поток ядра
+                        continue
+                self._write(os.path.join(self.root, "cgroup.subtree_control"), "+io")
+
+            os.makedirs(self.group_path, exist_ok=True)
+            self.enabled = True
+        except OSError as e:
+            # Причина выводится для шар, у которых заданы ограничения
+            self.enabled = False
+            self.error = str(e)
+        return self.enabled
+
+    @staticmethod
+    def _device_number(device):
+        rdev = os.stat(device).st_rdev
+        return f"{os.major(rdev)}:{os.minor(rdev)}"
+
+    def set_limits(self, device, limits):
+        """Применение ограничений {rbps, wbps, riops, wiops} к устройству. Отсутствующие - без ограничения"""
+        with self.lock:
+            if self.enabled is None:
+                self.error = "no share had io_limits at startup, restart to apply them"
+            if not self.enabled:
+                return False
+            values = " ".join(f"{key}={limits.get(key) or 'max'}" for key in self.KEYS)
+            try:
+                self._write(os.path.join(self.group_path, "io.max"), f"{self._device_number(device)} {values}")
+            except OSError as e:
+                print(f"Warning: failed to set I/O limits for {device}: {e}")
+                return False
+            self.limits[device] = dict(limits)
+            return True
+
+    def clear(self, device):
+        """Снятие ограничений устройства, в том числе оставшихся от прошлого запуска"""
+        with self.lock:
+            self.limits.pop(device, None)
+            if not self.enabled:
+                return
+            io_max = os.path.join(self.group_path, "io.max")
+            try:
+                number = self._device_number(device)
+                if number not in self._parse_device_lines(self._read(io_max)):
+                    return
+                values = " ".join(f"{key}=max" for key in self.KEYS)
+                self._write(io_max, f"{number} {values}")
+            except OSError:
+                pass
+
+    def add_process(self, pid):
+        """Перенос процесса в ограничиваемую cgroup (порожденные им процессы наследуют ее)"""
+        if not self.enabled:
+            return False
+        try:
+            self._write(os.path.join(self.group_path, "cgroup.procs"), str(pid))
+            return True
+        except OSError:
+            return False
+
+    def adopt(self, name="smbd"):
+        """Перенос всех процессов с заданным именем. Возвращает их количество"""
+        if not self.enabled:
+            return 0
+        adopted = 0
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/comm") as f:
+                    if f.read().strip() != name:
+                        continue
+            except OSError:
+                continue
+            adopted += self.add_process(pid)
+        return adopted
+
+    def _parse_device_lines(self, text):
+        result = {}
+        for line in text.splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            values = {}
+            for part in parts[1:]:
+                key, _, value = part.partition("=")
+                values[key] = None if value == "max" else int(value)
+            result[parts[0]] = values
+        return result
+
+    def state(self):
+        """Текущее состояние: {устройство: {"limits", "stats"}} и давление ввода-вывода группы"""
+        if not self.enabled:
+            return {}, {}
+        io_max = self._parse_device_lines(self._read(os.path.join(self.group_path, "io.max")))
+        io_stat = self._parse_device_lines(self._read(os.path.join(self.group_path, "io.stat")))
+
+        devices = {}
+        for device in list(self.limits):
+            try:
+                number = self._device_number(device)
+            except OSError:
+                continue
+            devices[device] = {"limits": io_max.get(number, {}), "stats": io_stat.get(number, {})}
+
+        # io.pressure: "some avg10=0.00 avg60=0.00 avg300=0.00 total=0"
+        pressure = {}
+        for line in self._read(os.path.join(self.group_path, "io.pressure")).splitlines():
+            kind, *fields = line.split()
+            pressure[kind] = {key: float(value) for key, _, value in (field.partition("=") for field in fields)}
+        return devices, pressure
+
+IO_LIMITER = IoLimiter()
@@ -1,6 +1,11 @@
 
+import os
+import re
 import subprocess
 from shell import Shell
+from .loopRegistry import LOOP_REGISTRY
+from .mountTable import MOUNT_TABLE
+from .ioLimits import IO_LIMITER
 
 class LoopError(Exception):
     def __init__(self, message):
@@ -12,36 +17,126 @@ class LoopError(Exception):
 
 class LoopManager(Shell):
     loop_devices = []
+    # Параметры loop-устройства шары: direct_io, sector_size, read_ahead_kb, scheduler
+    loop_options = {}
+    # Ограничения ввода-вывода шары (байт/операций в секунду): rbps, wbps, riops, wiops
+    io_limits = {}
+    sysfs_block = "/sys/block"
 
     def __init__(self):
         pass
 
     def _recover_loop_devices(self):
         """Восстанавливает loop-устройства, если образ уже смонтирован."""
+        for loop_dev in LOOP_REGISTRY.devices_for(self.disk_image):
+            if loop_dev not in self.loop_devices:
+                self.loop_devices.append(loop_dev)
+
+    def _attach_loop_device(self):
+        """Возвращает (устройство, создано ли оно), повторно используя уже подключенное устройство."""
+        try:
+            loop_dev, created = LOOP_REGISTRY.attach(self.disk_image, self._losetup_options())
+        except subprocess.CalledProcessError as e:
+            raise LoopError(f"Failed to setup loop device: {e}")
+
+        try:
+            self.apply_loop_options(loop_dev)
+        except LoopError as e:
+            # Неприменимые параметры (например, недоступный планировщик) не мешают подключению
+            print(f"Warning: {e}")
+        # Номер устройства мог измениться - правила io.max задаются заново
+        self.apply_io_limits(loop_dev)
+
+        if loop_dev not in self.loop_devices:
+            self.loop_devices.append(loop_dev)
+
+        # Лишние устройства, оставшиеся от прошлых запусков и нигде не смонтированные
+        for stale_dev in LOOP_REGISTRY.devices_for(self.disk_image):
+            if stale_dev != loop_dev and not MOUNT_TABLE.mount_points_for_device(stale_dev):
+                self._release_loop_device(stale_dev, True)
+
+        return loop_dev, created
+
+    def _losetup_options(self):
+        """Флаги losetup для подключения нового устройства."""
+        options = []
+        if self.loop_options.get('direct_io'):
+            options.append('--direct-io=on')
+        if self.loop_options.get('sector_size'):
+            options += ['--sector-size', str(self.loop_options['sector_size'])]
+        return options
+
+    def _read_sysfs(self, loop_device, *path):
         try:
-            loop_devs = self._run_command_output(
-                ['losetup', '-j', self.disk_image]
-            ).strip()
+            with open(os.path.join(self.sysfs_block, os.path.basename(loop_device), *path)) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def loop_settings(self, loop_device):
+        """Текущие параметры loop-устройства (из sysfs)."""
+        sector_size = self._read_sysfs(loop_device, 'queue', 'logical_block_size')
+        read_ahead_kb = self._read_sysfs(loop_device, 'queue', 'read_ahead_kb')
+        scheduler = self._read_sysfs(loop_device, 'queue', 'scheduler')
+        if scheduler:
+            # Активный планировщик указан в квадратных скобках: "[none] mq-deadline"
+            match = re.search(r'\[(.+?)\]', scheduler)
+            scheduler = match.group(1) if match else scheduler
+        return {
+            'direct_io': self._read_sysfs(loop_device, 'loop', 'dio') == '1',
+            'sector_size': int(sector_size) if sector_size else None,
+            'read_ahead_kb': int(read_ahead_kb) if read_ahead_kb else None,
+            'scheduler': scheduler,
+        }
+
+    def _write_sysfs(self, loop_device, value, *path):
+        try:
+            with open(os.path.join(self.sysfs_block, os.path.basename(loop_device), *path), 'w') as f:
+                f.write(str(value))
+        except OSError as e:
+            raise LoopError(f"Failed to set {'/'.join(path)} of {loop_device}: {e}")
+
+    def apply_loop_options(self, loop_device=None):
+        """Применяет параметры loop_options к устройству (или ко всем устройствам образа).
 
-            if loop_devs:
-                for line in loop_devs.splitlines():
-                    loop_dev = line.split(':')[0]
-                    self.loop_devices.append(loop_dev)
-        except subprocess.CalledProcessError:
-            pass
+        Меняются только отличающиеся параметры; размер сектора смонтированного
+        устройства не меняется.
+        """
+        options = self.loop_options
+        if not options:
+            return
+
+        for device in [loop_device] if loop_device else list(self.loop_devices):
+            current = self.loop_settings(device)
+            try:
+                if 'direct_io' in options and current['direct_io'] != options['direct_io']:
+                    self._run_command(['losetup', f"--direct-io={'on' if options['direct_io'] else 'off'}", device])
+                if options.get('sector_size') and current['sector_size'] != options['sector_size']:
+                    if MOUNT_TABLE.mount_points_for_device(device):
+                        self._print(f"Sector size of {device} will change after it is remounted")
+                    else:
+                        self._run_command(['losetup', '--sector-size', str(options['sector_size']), device])
+            except subprocess.CalledProcessError as e:
+                raise LoopError(f"Failed to configure loop device {device}: {e}")
+
+            if 'read_ahead_kb' in options and current['read_ahead_kb'] != options['read_ahead_kb']:
+                self._write_sysfs(device, options['read_ahead_kb'], 'queue', 'read_ahead_kb')
+            if 'scheduler' in options and current['scheduler'] != options['scheduler']:
+                self._write_sysfs(device, options['scheduler'], 'queue', 'scheduler')
+
+    def apply_io_limits(self, loop_device=None):
+        """Применяет io_limits к устройству (или ко всем устройствам образа).
+        Без io_limits снимается правило устройства, заданное и прошлым запуском."""
+        for device in [loop_device] if loop_device else list(self.loop_devices):
+            if self.io_limits:
+                IO_LIMITER.set_limits(device, self.io_limits)
+            else:
+                IO_LIMITER.clear(device)
 
     def _get_loop_device(self):
         """Получает или создает loop-устройство для операций с файловой системой."""
         if not self.loop_devices:
-            try:
-                loop_dev = self._run_command_output(
-                    ['losetup', '--find', '--show', self.disk_image]
-                ).strip()
-
-                self.loop_devices.append(loop_dev)
-                return loop_dev, True
-            except subprocess.CalledProcessError as e:
-                raise LoopError(f"Failed to setup loop device: {e}")
+            return self._attach_loop_device()
         return self.loop_devices[0], False
 
     def _release_loop_device(self, loop_device, temporary):
@@ -49,7 +144,10 @@ class LoopManager(Shell):
         if temporary:
             try:
                 self._run_command(['losetup', '-d', loop_device])
-
-                self.loop_devices.remove(loop_device)
             except subprocess.CalledProcessError as e:
                 raise LoopError(f"Failed to detach loop device: {e}")
+
+            LOOP_REGISTRY.unregister(loop_device)
+            IO_LIMITER.clear(loop_device)
+            if loop_device in self.loop_devices:
+                self.loop_devices.remove(loop_device)
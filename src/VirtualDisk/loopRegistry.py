@@ -0,0 +1,124 @@
+
+import os
+import json
+import threading
+import subprocess
+from shell import Shell
+
+class LoopRegistry(Shell):
+    """Соответствие файлов образов и подключенных к ним loop-устройств.
+
+    Все loop-устройства системы читаются за один проход из sysfs
+    (или одним вызовом `losetup --json --list`, если sysfs недоступен).
+    Реестр общий для всех дисков и обновляется при подключении/отключении.
+    """
+    sysfs_block = "/sys/block"
+
+    def __init__(self, debug=False):
+        super().__init__(debug)
+        self.moduleName = "LoopRegistry"
+        self.lock = threading.RLock()
+        self._by_file = None
+        self._by_device = None
+
+    @staticmethod
+    def _normalize(path):
+        if path.endswith(" (deleted)"):
+            path = path[:-len(" (deleted)")]
+        return os.path.realpath(path)
+
+    def _scan_sysfs(self):
+        devices = {}
+        for name in os.listdir(self.sysfs_block):
+            if not name.startswith("loop"):
+                continue
+            try:
+                with open(os.path.join(self.sysfs_block, name, "loop", "backing_file")) as f:
+                    devices[f"/dev/{name}"] = self._normalize(f.read().strip())
+            except OSError:
+                # Файл backing_file есть только у подключенных устройств
+                continue
+        return devices
+
+    def _scan_losetup(self):
+        output = self._run_command_output(['losetup', '--json', '--list'])
+        if not output.strip():
+            return {}
+        return {
+            device["name"]: self._normalize(device["back-file"])
+            for device in json.loads(output).get("loopdevices", [])
+            if device.get("back-file")
+        }
+
+    def _load(self):
+        try:
+            devices = self._scan_sysfs()
+        except OSError:
+            try:
+                devices = self._scan_losetup()
+            except (subprocess.CalledProcessError, ValueError):
+                devices = {}
+
+        self._by_device = devices
+        self._by_file = {}
+        for device in sorted(devices):
+            self._by_file.setdefault(devices[device], []).append(device)
+
+    def _ensure_loaded(self):
+        if self._by_device is None:
+            self._load()
+
+    def invalidate(self):
+        """Сбрасывает реестр; он будет перечитан при следующем запросе."""
+        with self.lock:
+            self._by_file = None
+            self._by_device = None
+
+    def devices_for(self, disk_image):
+        """Возвращает loop-устройства, подключенные к образу."""
+        with self.lock:
+            self._ensure_loaded()
+            return list(self._by_file.get(self._normalize(disk_image), []))
+
+    def backing_file(self, loop_device):
+        """Возвращает файл образа, подключенный к loop-устройству."""
+        with self.lock:
+            self._ensure_loaded()
+            return self._by_device.get(loop_device)
+
+    def register(self, loop_device, disk_image):
+        with self.lock:
+            self._ensure_loaded()
+            disk_image = self._normalize(disk_image)
+            self._by_device[loop_device] = disk_image
+            devices = self._by_file.setdefault(disk_image, [])
+            if loop_device not in devices:
+                devices.append(loop_device)
+
+    def unregister(self, loop_device):
+        with self.lock:
+            if self._by_device is None:
+                return
+            disk_image = self._by_device.pop(loop_device, None)
+            if disk_image is not None:
+                devices = self._by_file.get(disk_image, [])
+                if loop_device in devices:
+                    devices.remove(loop_device)
+                if not devices:
+                    self._by_file.pop(disk_image, None)
+
+    def attach(self, disk_image, options=None):
+        """Возвращает (устройство, создано ли оно). Уже подключенное устройство используется повторно.
+        options - дополнительные флаги losetup для нового устройства."""
+        with self.lock:
+            devices = self.devices_for(disk_image)
+            if devices:
+                return devices[0], False
+
+            loop_device = self._run_command_output(
+                ['losetup', *(options or []), '--find', '--show', disk_image]
+            ).strip()
+            self.register(loop_device, disk_image)
+            return loop_device, True
+
+LOOP_REGISTRY = LoopRegistry()
@@ -0,0 +1,67 @@
+
+import os
+import re
+import threading
+from .loopRegistry import LOOP_REGISTRY
+
+class MountTable:
+    """Индекс точек монтирования, построенный по /proc/self/mountinfo.
+
+    Индекс общий для всех дисков и перечитывается только после invalidate(),
+    которое вызывают операции mount/unmount. Файлы образов для loop-устройств
+    берутся из LOOP_REGISTRY.
+    """
+    mountinfo = "/proc/self/mountinfo"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_device = None
+        self._by_file = None
+
+    @staticmethod
+    def _unescape(value):
+        """mountinfo экранирует пробелы, табуляцию и '\\' восьмеричными кодами."""
+        return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), value)
+
+    def _load(self):
+        by_device = {}
+        by_file = {}
+
+        with open(self.mountinfo) as f:
+            for line in f:
+                fields = line.split()
+                # Поля: id parent major:minor root mount_point options [optional...] - fstype source super_options
+                separator = fields.index('-')
+                mount_point = self._unescape(fields[4])
+                source = self._unescape(fields[separator + 2])
+
+                by_device.setdefault(source, []).append(mount_point)
+                if source.startswith('/dev/loop'):
+                    backing_file = LOOP_REGISTRY.backing_file(source)
+                    if backing_file:
+                        by_file.setdefault(backing_file, []).append(mount_point)
+
+        self._by_device = by_device
+        self._by_file = by_file
+
+    def _ensure_loaded(self):
+        if self._by_device is None:
+            self._load()
+
+    def invalidate(self):
+        """Сбрасывает индекс; он будет перечитан при следующем запросе."""
+        with self._lock:
+            self._by_device = None
+            self._by_file = None
+
+    def mount_points_for_device(self, device):
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._by_device.get(device, []))
+
+    def mount_points_for_file(self, path):
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._by_file.get(os.path.realpath(path), []))
+
+MOUNT_TABLE = MountTable()
@@ -1,6 +1,12 @@
 from shell import Shell
 from .diskError import VirtualDiskError
+from .mountTable import MOUNT_TABLE
+from .loopRegistry import LOOP_REGISTRY
+from .loop import LoopError
 import subprocess
+import tempfile
+import math
+import time
 import os
 
 class diskOperations(Shell):
@@ -8,25 +14,166 @@ class diskOperations(Shell):
         self.disk_image = disk_image
         self.loop_devices = loop_devices
 
-    def create(self, size, fs_type='ext4'):
+    PREALLOCATION_MODES = ('sparse', 'falloc', 'full')
+    FILESYSTEMS = ('ext4', 'xfs', 'btrfs')
+    # Опции монтирования по умолчанию для файловой системы
+    DEFAULT_MOUNT_OPTIONS = {'btrfs': 'compress=zstd'}
+    mount_options = []
+    # Запас свободного места сверх минимального размера файловой системы при уменьшении
+    SHRINK_MARGIN = 0.1
+
+    def _allocate(self, size, preallocation):
+        """Выделяет место под образ заданного размера (в МБ)."""
+        if preallocation == 'sparse':
+            self._run_command(['truncate', '-s', f'{size}M', self.disk_image], check=True)
+        elif preallocation == 'falloc':
+            self._run_command(['fallocate', '-l', f'{size}M', self.disk_image], check=True)
+        else:
+            self._run_command(['dd', 'if=/dev/zero', f'of={self.disk_image}', 'bs=1M', f'count={size}'], check=True)
+
+    def _mkfs_options(self, fs_type, preallocation):
+        """Опции mkfs, соответствующие способу выделения места."""
+        if fs_type.startswith('ext') and preallocation == 'sparse':
+            # Discard обычного файла пробивает дыры, после чего mke2fs знает, что
+            # таблицы inode читаются как нули, и помечает их ITABLE_ZEROED -
+            # фоновое обнуление после монтирования не нужно
+            return ['-E', 'lazy_itable_init=1,lazy_journal_init=1']
+        if fs_type.startswith('ext') and preallocation == 'falloc':
+            # Discard пробил бы дыры в зарезервированном месте
+            return ['-E', 'lazy_itable_init=1,lazy_journal_init=1,nodiscard']
+        if fs_type in ('xfs', 'btrfs') and preallocation == 'falloc':
+            return ['-K']
+        return []
+
+    def create(self, size, fs_type='ext4', preallocation='full', mkfs_options=None):
         """Создает виртуальный диск заданного размера (в МБ) с указанной файловой системой."""
         if os.path.exists(self.disk_image):
             raise VirtualDiskError("Such a virtual disk has already been created")
 
-        self._run_command(['dd', 'if=/dev/zero', f'of={self.disk_image}', 'bs=1M', f'count={size}'], check=True)
-        self._run_command(['mkfs', '-t', fs_type, self.disk_image], check=True)
+        if preallocation not in self.PREALLOCATION_MODES:
+            raise VirtualDiskError(f"Unsupported preallocation mode: {preallocation}")
+
+        try:
+            try:
+                self._allocate(size, preallocation)
+            except subprocess.CalledProcessError as e:
+                raise VirtualDiskError(f"Failed to allocate disk image ({preallocation}): {e}")
+
+            options = [*self._mkfs_options(fs_type, preallocation), *(mkfs_options or [])]
+            try:
+                self._run_command(['mkfs', '-t', fs_type, *options, self.disk_image], check=True)
+            except subprocess.CalledProcessError as e:
+                raise VirtualDiskError(f"Failed to create {fs_type} filesystem: {e}")
+        except BaseException:
+            # Образ без файловой системы при следующем запуске считался бы существующим диском
+            if os.path.exists(self.disk_image):
+                os.remove(self.disk_image)
+            raise
+        finally:
+            self._invalidate_disk_info(filesystem=True)
+
+    def _clone_image(self, source, target):
+        """Копия образа: reflink (copy-on-write), если файловая система хоста его поддерживает,
+        иначе копирование с сохранением разреженности."""
+        try:
+            self._run_command(['cp', '--reflink=auto', '--sparse=always', source, target], check=True)
+        except subprocess.CalledProcessError as e:
+            if os.path.exists(target):
+                os.remove(target)
+            raise VirtualDiskError(f"Failed to copy disk image: {e}")
+
+    def create_from_template(self, template_image):
+        """Создает виртуальный диск как копию образа-шаблона."""
+        if os.path.exists(self.disk_image):
+            raise VirtualDiskError("Such a virtual disk has already been created")
+        if not os.path.exists(template_image):
+            raise VirtualDiskError(f"Template image does not exist: {template_image}")
+
+        try:
+            self._clone_image(template_image, self.disk_image)
+        finally:
+            self._invalidate_disk_info(filesystem=True)
+
+    def _reflink_supported(self, target):
+        """Проверяет пробным файлом, возможна ли reflink-копия из каталога образа в каталог target."""
+        fd, probe = tempfile.mkstemp(prefix='.reflink-', dir=os.path.dirname(os.path.abspath(self.disk_image)))
+        clone = os.path.join(os.path.dirname(os.path.abspath(target)), os.path.basename(probe) + '.clone')
+        try:
+            os.write(fd, b'\0' * 4096)
+            os.close(fd)
+            self._run_command(['cp', '--reflink=always', probe, clone], check=True)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+        finally:
+            for path in (probe, clone):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def snapshot(self, target=None):
+        """Снимок образа на текущий момент. Только reflink-копия: смонтированная
+        файловая система замораживается (fsfreeze) на время клонирования, полное
+        копирование данных под заморозкой заблокировало бы запись в шару.
+        Возвращает путь к снимку."""
+        if not os.path.exists(self.disk_image):
+            raise VirtualDiskError("Disk image does not exist")
+        if target is None:
+            base, ext = os.path.splitext(self.disk_image)
+            target = f"{base}-{time.strftime('%Y%m%d-%H%M%S')}{ext or '.img'}"
+        if os.path.exists(target):
+            raise VirtualDiskError(f"Snapshot already exists: {target}")
+        if not self._reflink_supported(target):
+            raise VirtualDiskError("Snapshots require reflink support (btrfs or XFS) on the host filesystem")
+
+        frozen = []
+        try:
+            for mount_point in self.get_mount_points():
+                self._run_command(['fsfreeze', '-f', mount_point], check=True)
+                frozen.append(mount_point)
+            self._run_command(['cp', '--reflink=always', self.disk_image, target], check=True)
+        except subprocess.CalledProcessError as e:
+            if os.path.exists(target):
+                os.remove(target)
+            raise VirtualDiskError(f"Failed to create snapshot: {e}")
+        finally:
+            for mount_point in frozen:
+                self._run_command(['fsfreeze', '-u', mount_point], check=False)
+        return target
 
     def mount(self, mount_point):
         """Монтирует виртуальный диск в заданную точку монтирования."""
         if not os.path.exists(mount_point):
             os.makedirs(mount_point)
 
-        loop_device = self._run_command_output(
-            ['losetup', '--show', '-f', self.disk_image]
-        ).strip()
-        self.loop_devices.append(loop_device)
+        loop_device, _ = self._attach_loop_device()
 
-        self._run_command(['mount', loop_device, mount_point], check=True)
+        options = self._mount_options()
+        try:
+            self._run_command(['mount', *(['-o', options] if options else []), loop_device, mount_point], check=True)
+        finally:
+            MOUNT_TABLE.invalidate()
+            self._invalidate_disk_info()
+
+    def _mount_options(self):
+        """Опции монтирования: по умолчанию для файловой системы и заданные для шары."""
+        options = list(self.mount_options)
+        default = self.DEFAULT_MOUNT_OPTIONS.get(self._detect_filesystem())
+        # Заданная для шары опция заменяет одноименную опцию по умолчанию
+        if default and not any(option.split('=')[0] == default.split('=')[0] for option in options):
+            options.insert(0, default)
+        return ','.join(options)
+
+    def remount(self, mount_point):
+        """Применяет опции монтирования к уже смонтированному диску."""
+        options = self._mount_options()
+        if not options:
+            return
+        try:
+            self._run_command(['mount', '-o', f'remount,{options}', mount_point], check=True)
+        except subprocess.CalledProcessError as e:
+            raise VirtualDiskError(f"Failed to remount: {e}")
+        finally:
+            MOUNT_TABLE.invalidate()
 
     def unmount(self, mount_point):
         """Размонтирует виртуальный диск из заданной точки монтирования."""
@@ -34,17 +181,81 @@ class diskOperations(Shell):
             self._run_command(['umount', mount_point], check=True)
         except subprocess.CalledProcessError as e:
             raise VirtualDiskError(f"Failed to unmount: {e}")
+        finally:
+            MOUNT_TABLE.invalidate()
+            self._invalidate_disk_info()
 
-        for loop_device in self.loop_devices:
+        for loop_device in list(self.loop_devices):
+            # Устройство, смонтированное в другой точке, не отключаем
+            if MOUNT_TABLE.mount_points_for_device(loop_device):
+                continue
             try:
-                self._run_command(['losetup', '-d', loop_device], check=True)
-            except subprocess.CalledProcessError as e:
+                self._release_loop_device(loop_device, True)
+            except LoopError as e:
                 raise VirtualDiskError(f"Failed to detach loop device: {e}")
 
-        self.loop_devices.clear()
+    def release(self, timeout=None):
+        """Отмонтирует образ из всех точек и отключает все его loop-устройства."""
+        for mount_point in self.get_mount_points():
+            try:
+                self._run_command(['umount', mount_point], check=True, timeout=timeout)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                raise VirtualDiskError(f"Failed to unmount: {e}")
+            finally:
+                MOUNT_TABLE.invalidate()
+                self._invalidate_disk_info()
+
+        for loop_device in LOOP_REGISTRY.devices_for(self.disk_image):
+            if loop_device not in self.loop_devices:
+                self.loop_devices.append(loop_device)
+        for loop_device in list(self.loop_devices):
+            try:
+                self._release_loop_device(loop_device, True)
+            except LoopError as e:
+                raise VirtualDiskError(f"Failed to detach loop device: {e}")
+
+    def _needs_fsck(self, device):
+        """Проверяет по суперблоку ext, требуется ли полная проверка файловой системы."""
+        try:
+            output = self._run_command_output(['tune2fs', '-l', device])
+        except subprocess.CalledProcessError:
+            return True
+
+        fields = {}
+        for line in output.splitlines():
+            if ':' in line:
+                name, value = line.split(':', 1)
+                fields[name.strip()] = value.strip()
+
+        if fields.get('Filesystem state') != 'clean':
+            return True
+
+        try:
+            max_mount_count = int(fields.get('Maximum mount count', '-1'))
+            mount_count = int(fields.get('Mount count', '0'))
+        except ValueError:
+            return False
+        return max_mount_count > 0 and mount_count >= max_mount_count
+
+    def needs_check(self):
+        """Требуется ли полная проверка файловой системы образа перед изменением размера."""
+        if not self._detect_filesystem().startswith('ext'):
+            return False
+        return self._needs_fsck(self.disk_image)
+
+    def _mounted_loop_device(self):
+        """Возвращает loop-устройство, через которое смонтирован образ."""
+        for loop_device in self.loop_devices:
+            if MOUNT_TABLE.mount_points_for_device(loop_device):
+                return loop_device
+        return None
 
     def resize(self, new_size_mb):
-        """Изменяет размер виртуального диска (в МБ)."""
+        """Изменяет размер виртуального диска (в МБ).
+
+        Смонтированный диск с чистой файловой системой увеличивается онлайн,
+        несмонтированный - офлайн с полной проверкой.
+        """
         if not os.path.exists(self.disk_image):
             raise VirtualDiskError("Disk image does not exist")
 
@@ -52,6 +263,55 @@ class diskOperations(Shell):
         if new_size_mb <= current_size:
             raise VirtualDiskError("New size must be larger than current size")
 
+        fs_type = self._detect_filesystem()
+        if not fs_type.startswith('ext') and fs_type not in self.FILESYSTEMS:
+            raise VirtualDiskError(f"Unsupported filesystem for resize: {fs_type}")
+
+        loop_device = self._mounted_loop_device()
+        if loop_device is None:
+            self._resize_offline(new_size_mb)
+        elif fs_type.startswith('ext') and self._needs_fsck(loop_device):
+            # e2fsck нельзя запускать на смонтированной файловой системе
+            raise VirtualDiskError("filesystem needs an offline check; remount required")
+        else:
+            self._grow_online(new_size_mb, loop_device)
+
+    def _grow_filesystem(self, loop_device, mount_point):
+        """Расширяет файловую систему до размера loop-устройства."""
+        fs_type = self._detect_filesystem()
+        if fs_type.startswith('ext'):
+            self._run_command(['resize2fs', loop_device], check=True)
+        elif fs_type == 'xfs':
+            self._run_command(['xfs_growfs', mount_point], check=True)
+        elif fs_type == 'btrfs':
+            self._run_command(['btrfs', 'filesystem', 'resize', 'max', mount_point], check=True)
+        else:
+            raise VirtualDiskError(f"Unsupported filesystem for resize: {fs_type}")
+
+    def _grow_online(self, new_size_mb, loop_device):
+        """Увеличивает смонтированный диск без отмонтирования и без проверки."""
+        try:
+            # 1. Изменяем размер образа
+            self._run_command(
+                ['truncate', '-s', f'{new_size_mb}M', self.disk_image],
+                check=True
+            )
+
+            # 2. Обновляем размер уже подключенного loop-устройства
+            self._run_command(
+                ['losetup', '-c', loop_device],
+                check=True
+            )
+
+            # 3. Расширяем смонтированную файловую систему до размера устройства
+            self._grow_filesystem(loop_device, MOUNT_TABLE.mount_points_for_device(loop_device)[0])
+        except subprocess.CalledProcessError as e:
+            raise VirtualDiskError(f"Failed to grow disk online: {e}")
+        finally:
+            self._invalidate_disk_info()
+
+    def _resize_offline(self, new_size_mb):
+        """Изменяет размер несмонтированного диска (в МБ)."""
         loop_device, is_temp = self._get_loop_device()
 
         try:
@@ -95,16 +355,90 @@ class diskOperations(Shell):
                     raise VirtualDiskError(f"Failed to resize: expected {new_size_mb}MB, got {final_size}MB")
 
             else:
-                raise VirtualDiskError(f"Unsupported filesystem for resize: {fs_type}")
+                # xfs и btrfs увеличиваются только смонтированными - монтируем временно
+                mount_point = tempfile.mkdtemp(prefix="vd-resize-")
+                try:
+                    self._run_command(['mount', loop_device, mount_point], check=True)
+                    try:
+                        self._grow_filesystem(loop_device, mount_point)
+                    finally:
+                        self._run_command(['umount', mount_point], check=True)
+                finally:
+                    MOUNT_TABLE.invalidate()
+                    os.rmdir(mount_point)
 
         except subprocess.CalledProcessError as e:
             raise VirtualDiskError(f"Failed to resize disk: {e}")
         except Exception as e:
             raise VirtualDiskError(f"Unexpected error during resize: {e}")
         finally:
+            self._invalidate_disk_info()
             self._release_loop_device(loop_device, is_temp)
 
+    def _ext_block_size(self, device):
+        output = self._run_command_output(['tune2fs', '-l', device])
+        return int(output.split('Block size:')[1].split()[0])
+
+    def shrink(self, new_size_mb):
+        """Уменьшает несмонтированный диск с файловой системой ext (в МБ).
+
+        Новый размер должен вмещать минимальный размер файловой системы
+        (resize2fs -P) с запасом SHRINK_MARGIN. Возвращает освобожденное
+        на хосте место (в байтах).
+        """
+        if not os.path.exists(self.disk_image):
+            raise VirtualDiskError("Disk image does not exist")
+        if not self._detect_filesystem().startswith('ext'):
+            raise VirtualDiskError(f"Shrinking is supported only for ext filesystems, not {self._detect_filesystem()}")
+        if self.get_mount_points():
+            raise VirtualDiskError("Disk must be unmounted to shrink")
+
+        current_size = os.path.getsize(self.disk_image) // (1024 * 1024)
+        if new_size_mb >= current_size:
+            raise VirtualDiskError("New size must be smaller than current size")
+
+        allocated_before = os.stat(self.disk_image).st_blocks * 512
+        loop_device, is_temp = self._get_loop_device()
+        try:
+            # 1. Проверяем файловую систему (resize2fs требует проверки перед уменьшением)
+            self._run_command(['e2fsck', '-f', '-y', loop_device], check=True)
+
+            # 2. Проверяем, что данные поместятся в новый размер с запасом
+            block_size = self._ext_block_size(loop_device)
+            output = self._run_command_output(['resize2fs', '-P', loop_device])
+            min_blocks = int(output.rsplit(':', 1)[1].split()[0])
+            min_size_mb = math.ceil(min_blocks * block_size / (1024 * 1024))
+            required_mb = math.ceil(min_size_mb * (1 + self.SHRINK_MARGIN))
+            if new_size_mb < required_mb:
+                raise VirtualDiskError(
+                    f"Cannot shrink to {new_size_mb}MB: the filesystem needs at least {required_mb}MB "
+                    f"({min_size_mb}MB + {self.SHRINK_MARGIN:.0%} margin)"
+                )
+
+            # 3. Уменьшаем файловую систему
+            blocks_count = (new_size_mb * 1024 * 1024) // block_size
+            self._run_command(['resize2fs', loop_device, f'{blocks_count}'], check=True)
+        except subprocess.CalledProcessError as e:
+            raise VirtualDiskError(f"Failed to shrink disk: {e}")
+        finally:
+            # Временное устройство отключается до обрезки образа
+            self._release_loop_device(loop_device, is_temp)
+            self._invalidate_disk_info()
+
+        try:
+            # 4. Обрезаем образ
+            self._run_command(['truncate', '-s', f'{new_size_mb}M', self.disk_image], check=True)
+            if not is_temp:
+                self._run_command(['losetup', '-c', loop_device], check=True)
+        except subprocess.CalledProcessError as e:
+            raise VirtualDiskError(f"Failed to truncate disk image: {e}")
+        finally:
+            self._invalidate_disk_info()
+
+        return max(0, allocated_before - os.stat(self.disk_image).st_blocks * 512)
+
     def cleanup(self):
         """Удаляет файл виртуального диска."""
         if os.path.exists(self.disk_image):
             os.remove(self.disk_image)
+        self._invalidate_disk_info(filesystem=True)
@@ -1,38 +1,22 @@
 import os
-import re
+import sys
 import json
+import time
+import signal
+import threading
 from samba import Samba, SambaError, SambaConfigureError
-from VirtualDisk import VirtualDisk
-from config import USERS, GROUPS, SHARE, APP_CONFIG
-
-################################################################################
-
-def convert_to_mb(size, unit):
-    unit = unit.upper()
-
-    conversion_factors = {
-        'B': 1 / (1024 * 1024),
-        'KB': 1 / 1024,
-        'MB': 1,
-        'GB': 1024,
-        'TB': 1024 * 1024,
-        'PB': 1024 * 1024 * 1024
-    }
-
-    if unit not in conversion_factors:
-        raise ValueError(f"Unsupported unit: {unit}. Supported units are: B, KB, MB, GB, TB, PB")
-
-    return size * conversion_factors[unit]
-
-def convert_to_mb_auto(size_str):
-    match = re.match(r'^([\d.]+)\s*([A-Za-z]+)$', size_str.strip())
-    if not match:
-        raise ValueError("Invalid size format. Expected format like '500KB' or '2GB'")
-
-    size = float(match.group(1))
-    unit = match.group(2).upper()
-
-    return convert_to_mb(size, unit)
+from VirtualDisk import IO_LIMITER
+from provision import Provisioner
+from reconcile import Reconciler
+from state import StateStore
+from watcher import ConfigWatcher
+from shell import Shell
+from autogrow import UsageWatcher
+from trim import TrimScheduler
+from metrics import MetricsExporter
+from runtime import AsyncRuntime
+import config
+from config import USERS, SHARE, APP_CONFIG, PROVISION_CONFIG, MONITOR_CONFIG, PROFILING_CONFIG, METRICS_CONFIG, AUTOGROW_CONFIG, WATCHER_CONFIG, RUNTIME_CONFIG, SHUTDOWN_CONFIG, TRIM_CONFIG, STATE_FILENAME, CONFIG_FILENAME
 
 ################################################################################
 
@@ -66,94 +50,220 @@ WHITE_COLOR = "\033[0m"
 
 ################################################################################
 
-samba = Samba(**APP_CONFIG)
-samba.stop_samba()
+def publish_shares(results):
+    """Вывод информации о дисках и добавление шар в конфигурацию Samba"""
+    samba.clear_shares()
+    DISKS_LIST.clear()
+
+    for result in results:
+        key = result.key
+        share_conf = config.SHARE[key]
+        if result.error is not None:
+            print(f"Failed to provision share '{key}': {result.error}")
+            continue
+
+        users_share = list(share_conf.get("users", []))
+        for group in share_conf.get("groups", []):
+            users_share.extend(user for user in config.GROUPS.get(group, []) if user not in users_share)
+
+        disk_info = result.disk_info
+        print()
+        print(f"{TURQUOISE_COLOR}{key}:{WHITE_COLOR}")
+        print(f"  {BLUE_COLOR}• Path:{WHITE_COLOR} {disk_info['disk_file']}")
+        print(f"  {BLUE_COLOR}• Size:{WHITE_COLOR} {disk_info['size_mb']} MB (allocated {disk_info['allocated_mb']} MB)")
+        print(f"  {BLUE_COLOR}• Filesystem:{WHITE_COLOR} {disk_info['filesystem']}")
+        print(f"  {BLUE_COLOR}• Mounted:{WHITE_COLOR} {'Yes' if disk_info['mounted'] else 'No'}")
+        for loop_device, settings in disk_info['loop'].items():
+            print(f"  {BLUE_COLOR}• Loop:{WHITE_COLOR} {loop_device} (direct I/O {'on' if settings['direct_io'] else 'off'}, "
+                  f"sector {settings['sector_size']}, read-ahead {settings['read_ahead_kb']} KB, scheduler {settings['scheduler']})")
+        if result.disk.io_limits:
+            limits = ", ".join(f"{name} {value}" for name, value in result.disk.io_limits.items())
+            print(f"  {BLUE_COLOR}• I/O limits:{WHITE_COLOR} {limits if IO_LIMITER.enabled else 'not applied (' + str(IO_LIMITER.error) + ')'}")
+
+        if disk_info['mounted']:
+            print(f"  {BLUE_COLOR}• Mount points:{WHITE_COLOR}")
+            for mp in disk_info['mount_points']:
+                print(f"    - {mp}")
+
+            print(f"  {BLUE_COLOR}• Usage:{WHITE_COLOR}")
+            for mp, usage in disk_info['usage'].items():
+                print(f"    {YELLOW_COLOR}{mp}:{WHITE_COLOR}")
+                print(f"      Total: {usage['total_gb']:.2f} GB")
+                print(f"      Used: {usage['used_gb']:.2f} GB ({usage['use_percent']:.1f}%)")
+                print(f"      Free: {usage['free_gb']:.2f} GB")
+        print()
+
+        samba.add_share(
+            share_name      = key,
+            path            = provisioner.mount_point(key),
+            valid_users     = users_share,
+            read_only       = share_conf["read_only"] if "read_only" in share_conf else False,
+            profile         = share_conf.get("profile")
+        )
+
+        DISKS_LIST.append(result.disk)
+
+    provisioner.print_summary(results)
+
+def reload_configuration():
+    """Применение изменившегося config.yml без перезапуска smbd"""
+    if not config.reload_config():
+        print(f"Configuration '{CONFIG_FILENAME}' is invalid. Keeping the current one")
+        return
+
+    print(f"Configuration '{CONFIG_FILENAME}' changed. Applying")
+    with reconciler.lock:
+        reconciler.refresh()
+        kept, pending, removed = reconciler.plan_shares(config.SHARE)
+
+        # Отключаем клиентов только от тех шар, которые будут перемонтированы или удалены
+        affected = reconciler.affected_shares(config.SHARE, pending, removed)
+        trim_scheduler.exclude(affected)
+        for key in affected:
+            try:
+                samba.close_share(key)
+            except SambaError as e:
+                print(e)
+
+        reconciler.apply_users(config.USERS)
+        results = reconciler.apply_shares(config.SHARE, kept, pending, removed)
+        publish_shares(results)
+        usage_watcher.update(config.SHARE, reconciler.disks)
+        trim_scheduler.update(config.SHARE, reconciler.disks)
+        state.save()
+
+        if samba.configure_global_settings():
+            samba.reload_samba()
+            print("Samba configuration reloaded")
+        IO_LIMITER.adopt("smbd")
+
+def request_shutdown(signum, frame):
+    """Обработчик SIGTERM/SIGINT: остановка выполняется основным потоком"""
+    # Повторный сигнал завершает процесс сразу
+    signal.signal(signum, signal.SIG_DFL)
+    print(f"Received {signal.Signals(signum).name}. Stopping")
+    stopping.set()
+
+def shutdown():
+    """Остановка: smbd, затем параллельное отмонтирование всех шар"""
+    started = time.monotonic()
+    deadline = SHUTDOWN_CONFIG["timeout"]
 
-for user_key in USERS:
     try:
-        samba.create_linux_user(user_key, USERS[user_key])
-    except SambaError:
-        print(f"User '{user_key}' already exist. Skipping")
+        # Зависший smbd не должен занять весь срок - остальное нужно на отмонтирование шар
+        samba.stop_samba(timeout=deadline / 2)
     except Exception as e:
-        print(e)
-    samba.create_samba_user(user_key, USERS[user_key])
+        print(f"Failed to stop smbd: {e}")
+    print(f"smbd stopped in {time.monotonic() - started:.2f}s")
+    trim_scheduler.stop(timeout=max(0.0, deadline - (time.monotonic() - started)))
+
+    # Ждем завершения идущих изменений дисков (автоувеличение, перезагрузка конфига)
+    locked = reconciler.lock.acquire(timeout=max(0.0, deadline - (time.monotonic() - started)))
+    try:
+        os.sync()
+        # Без блокировки освобождаем и диски, которые еще готовит перезагрузка конфига
+        disks = dict(reconciler.disks) if locked else {**provisioner.active, **reconciler.disks}
+        results = provisioner.release(disks, max(0.0, deadline - (time.monotonic() - started)))
+        provisioner.print_release_summary(results)
+    finally:
+        if locked:
+            reconciler.lock.release()
+
+    print(f"Stopped in {time.monotonic() - started:.2f}s")
+    sys.exit(0)
+
+def shutdown_if_requested():
+    if stopping.is_set():
+        shutdown()
 
 ################################################################################
 
-for key in SHARE:
-    share_conf = SHARE[key]
-    img_path = os.path.join(DISKS_PATH, share_conf["filename"] if "filename" in share_conf else (key + ".img"))
-    img_mount_path = os.path.join(DISKS_MOUNT_PATH, key)
-    disk = VirtualDisk(img_path, debug=APP_CONFIG["debug"])
-    disk_size = int(convert_to_mb_auto(share_conf["size"]))
-    try:
-        disk.create(disk_size)
-        print(f"Disk {key} created.")
-    except Exception as e:
-        print(f"Disk {key} exist. Skipping")
-
-    for point in disk.get_mount_points():
-        try:
-            print(f"Removing mount point '{point}' for '{key}'")
-            disk.unmount(point)
-        except Exception as e:
-            print(e)
-
-    if (disk.get_disk_info()["size_mb"] != disk_size) and not ("auto_resize" in share_conf and not share_conf["auto_resize"]):
-        print(f"Resize {key} ({disk.get_disk_info()['size_mb']}MB => {disk_size}MB)")
-        disk.resize(disk_size)
-
-    disk.mount(img_mount_path)
-
-    users_share = share_conf.get("users", [])
-    for group in share_conf.get("groups", []):
-        users_share.extend(user for user in GROUPS.get(group, []) if user not in users_share)
-
-    disk_info = disk.get_disk_info()
-    print()
-    print(f"{TURQUOISE_COLOR}{key}:{WHITE_COLOR}")
-    print(f"  {BLUE_COLOR}• Path:{WHITE_COLOR} {disk_info['disk_file']}")
-    print(f"  {BLUE_COLOR}• Size:{WHITE_COLOR} {disk_info['size_mb']} MB")
-    print(f"  {BLUE_COLOR}• Filesystem:{WHITE_COLOR} {disk_info['filesystem']}")
-    print(f"  {BLUE_COLOR}• Mounted:{WHITE_COLOR} {'Yes' if disk_info['mounted'] else 'No'}")
-
-    if disk_info['mounted']:
-        print(f"  {BLUE_COLOR}• Mount points:{WHITE_COLOR}")
-        for mp in disk_info['mount_points']:
-            print(f"    - {mp}")
-
-        print(f"  {BLUE_COLOR}• Usage:{WHITE_COLOR}")
-        for mp, usage in disk_info['usage'].items():
-            print(f"    {YELLOW_COLOR}{mp}:{WHITE_COLOR}")
-            print(f"      Total: {usage['total_gb']:.2f} GB")
-            print(f"      Used: {usage['used_gb']:.2f} GB ({usage['use_percent']:.1f}%)")
-            print(f"      Free: {usage['free_gb']:.2f} GB")
-    print()
-
-    samba.add_share(
-        share_name      = key,
-        path            = img_mount_path,
-        valid_users     = users_share,
-        read_only       = share_conf["read_only"] if "read_only" in share_conf else False
-    )
-
-    DISKS_LIST.append(disk)
-
-# print(DISKS_LIST)
+Shell.set_heavy_limit(RUNTIME_CONFIG["heavy_limit"])
+# Иерархия cgroup меняется только при заданных ограничениях и только пока нет других потоков
+if any(share_conf.get("io_limits") for share_conf in SHARE.values()):
+    IO_LIMITER.setup()
+
+samba = Samba(**APP_CONFIG)
+samba.on_smbd_start = IO_LIMITER.add_process
+state = StateStore(STATE_FILENAME)
+provisioner = Provisioner(
+    DISKS_PATH,
+    DISKS_MOUNT_PATH,
+    workers = PROVISION_CONFIG["workers"],
+    debug   = APP_CONFIG["debug"]
+)
+reconciler = Reconciler(samba, provisioner, state, debug=APP_CONFIG["debug"])
+usage_watcher = UsageWatcher(
+    min_interval    = AUTOGROW_CONFIG["min_interval"],
+    max_interval    = AUTOGROW_CONFIG["max_interval"],
+    lock            = reconciler.lock
+)
+trim_scheduler = TrimScheduler(
+    interval        = TRIM_CONFIG["interval"],
+    window          = TRIM_CONFIG["window"],
+    debug           = APP_CONFIG["debug"]
+)
+
+stopping = threading.Event()
+signal.signal(signal.SIGTERM, request_shutdown)
+signal.signal(signal.SIGINT, request_shutdown)
+
+kept, pending, removed = reconciler.plan_shares(SHARE)
+if (pending or removed) and samba.is_running():
+    samba.stop_samba()
+
+users_changed = reconciler.apply_users(USERS)
+if users_changed:
+    print(f"Users updated: {users_changed}")
+
+################################################################################
+
+publish_shares(reconciler.apply_shares(SHARE, kept, pending, removed))
+usage_watcher.update(SHARE, reconciler.disks)
+trim_scheduler.update(SHARE, reconciler.disks)
+state.save()
+# Сигнал во время подготовки обрабатывается после нее - подключенные диски освобождаются
+shutdown_if_requested()
 
 ################################################################################
 
-samba.configure_global_settings()
+config_changed = samba.configure_global_settings()
 try:
     samba.configure_firewall()
 except Exception as e:
     print(e)
 
-samba.restart_samba()
+if config_changed or not samba.is_running():
+    samba.restart_samba()
+# Процессы smbd переносятся в cgroup с ограничениями ввода-вывода шар
+IO_LIMITER.adopt("smbd")
+shutdown_if_requested()
+
+print(Shell.command_report())
+print()
 
 print("Saamba is running")
 for key in SHARE:
     print(f" • \\\\<server_ip>\\{key}")
 print()
 
-samba.monitor()
+watcher = ConfigWatcher(CONFIG_FILENAME, reload_configuration, interval=WATCHER_CONFIG["interval"])
+
+samba.start_profile_sampler(**PROFILING_CONFIG)
+
+trim_scheduler.start()
+
+metrics = MetricsExporter(samba, provisioner, reconciler.disks, trim_scheduler, **METRICS_CONFIG)
+metrics.start()
+
+# Основной поток только ожидает сигнала остановки
+if RUNTIME_CONFIG["async"]:
+    runtime = AsyncRuntime(samba, usage_watcher, watcher, MONITOR_CONFIG)
+    threading.Thread(target=runtime.start, name="async-runtime", daemon=True).start()
+else:
+    watcher.start()
+    usage_watcher.start()
+    threading.Thread(target=samba.monitor, kwargs=MONITOR_CONFIG, name="monitor", daemon=True).start()
+
+stopping.wait()
+shutdown()
@@ -0,0 +1,111 @@
+import time
+import asyncio
+import threading
+
+from provision import convert_to_mb_auto
+
+class UsageWatcher:
+    """Онлайн-увеличение шар при достижении порога заполнения.
+
+    Частота проверки шары зависит от запаса до порога: чем ближе
+    заполнение к grow_at_percent, тем чаще она проверяется.
+    """
+    def __init__(self, min_interval=5, max_interval=300, lock=None):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.lock = lock or threading.Lock()
+        self._shares = {}
+        self._next_check = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _policy(share_conf):
+        if "grow_at_percent" not in share_conf:
+            return None
+        return {
+            "at_percent": share_conf["grow_at_percent"],
+            "step_mb": int(convert_to_mb_auto(share_conf.get("grow_step", "1GB"))),
+            "max_mb": int(convert_to_mb_auto(share_conf["max_size"])) if "max_size" in share_conf else None,
+        }
+
+    def update(self, shares, disks):
+        """Обновление списка отслеживаемых шар (при запуске и перезагрузке конфига)"""
+        watched = {}
+        for key, share_conf in shares.items():
+            policy = self._policy(share_conf)
+            if policy is not None and key in disks:
+                watched[key] = (disks[key], policy)
+
+        with self.lock:
+            self._shares = watched
+            self._next_check = {key: self._next_check.get(key, 0) for key in watched}
+        self._wakeup.set()
+
+    def _interval(self, use_percent, at_percent):
+        headroom = max(0.0, min(1.0, (at_percent - use_percent) / at_percent))
+        return self.min_interval + (self.max_interval - self.min_interval) * headroom
+
+    def check(self, key, disk, policy):
+        """Проверка заполнения шары. Возвращает задержку до следующей проверки"""
+        info = disk.get_disk_info()
+        if not info["usage"]:
+            return self.max_interval
+
+        use_percent = max(usage["use_percent"] for usage in info["usage"].values())
+        if use_percent < policy["at_percent"]:
+            return self._interval(use_percent, policy["at_percent"])
+
+        size_mb = info["size_mb"]
+        new_size_mb = size_mb + policy["step_mb"]
+        if policy["max_mb"] is not None:
+            new_size_mb = min(new_size_mb, policy["max_mb"])
+        if new_size_mb <= size_mb:
+            return self.max_interval
+
+        print(f"Share '{key}' is {use_percent:.1f}% full. Growing {size_mb}MB => {new_size_mb}MB")
+        disk.resize(new_size_mb)
+        return self.min_interval
+
+    def _check_due(self):
+        """Проверка шар, для которых подошло время. Возвращает время до следующей проверки"""
+        with self.lock:
+            now = time.monotonic()
+            for key, (disk, policy) in self._shares.items():
+                if self._next_check[key] > now:
+                    continue
+                try:
+                    delay = self.check(key, disk, policy)
+                except Exception as e:
+                    print(f"Failed to auto-grow share '{key}': {e}")
+                    delay = self.max_interval
+                self._next_check[key] = time.monotonic() + delay
+
+            return min(self._next_check.values(), default=now + self.max_interval) - time.monotonic()
+
+    def _run(self):
+        while not self._stop.is_set():
+            timeout = self._check_due()
+            self._wakeup.wait(max(0.0, timeout))
+            self._wakeup.clear()
+
+    async def run_async(self):
+        """Вариант для цикла событий: проверки с resize выполняются в пуле потоков"""
+        while not self._stop.is_set():
+            timeout = await asyncio.to_thread(self._check_due)
+            # update() будит поток через _wakeup, здесь достаточно ограничить сон
+            await asyncio.sleep(max(0.0, min(timeout, self.min_interval)))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="usage-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
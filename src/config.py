@@ -9,6 +9,7 @@ import os
 ################################################################################
 
 CONFIG_FILENAME = "config/config.yml"
+STATE_FILENAME = os.path.join(os.path.dirname(CONFIG_FILENAME), "state.json")
 SCHEMA = {
     "type": "object",
     "properties": {
@@ -41,7 +42,67 @@ SCHEMA = {
                             "pattern": "^\\d+(B|KB|MB|GB|TB|PB)$"
                         },
                         "read_only": {"type": "boolean"},
-                        "auto_resize": {"type": "boolean"},
+                        "auto_resize": {
+                            "oneOf": [
+                                {"type": "boolean"},
+                                {"type": "string", "enum": ["grow", "shrink", "both"]}
+                            ]
+                        },
+                        "preallocation": {
+                            "type": "string",
+                            "enum": ["sparse", "falloc", "full"]
+                        },
+                        "template": {"type": "string"},
+                        "filesystem": {
+                            "type": "string",
+                            "enum": ["ext4", "xfs", "btrfs"]
+                        },
+                        "mkfs_options": {
+                            "type": "array",
+                            "items": {"type": "string"}
+                        },
+                        "mount_options": {
+                            "type": "array",
+                            "items": {"type": "string", "pattern": "^[^,\\s]+$"}
+                        },
+                        "trim": {"type": "boolean"},
+                        "loop": {
+                            "type": "object",
+                            "properties": {
+                                "direct_io": {"type": "boolean"},
+                                "sector_size": {"type": "integer", "enum": [512, 1024, 2048, 4096]},
+                                "read_ahead_kb": {"type": "integer", "minimum": 0},
+                                "scheduler": {"type": "string", "enum": ["none", "mq-deadline", "bfq", "kyber"]}
+                            },
+                            "additionalProperties": False
+                        },
+                        "io_limits": {
+                            "type": "object",
+                            "properties": {
+                                "rbps": {"type": "string", "pattern": "^\\d+(B|KB|MB|GB|TB|PB)$"},
+                                "wbps": {"type": "string", "pattern": "^\\d+(B|KB|MB|GB|TB|PB)$"},
+                                "riops": {"type": "integer", "minimum": 1},
+                                "wiops": {"type": "integer", "minimum": 1}
+                            },
+                            "additionalProperties": False
+                        },
+                        "profile": {
+                            "type": "string",
+                            "enum": ["default", "sequential", "small_files", "many_clients"]
+                        },
+                        "grow_at_percent": {
+                            "type": "number",
+                            "exclusiveMinimum": 0,
+                            "exclusiveMaximum": 100
+                        },
+                        "grow_step": {
+                            "type": "string",
+                            "pattern": "^\\d+(B|KB|MB|GB|TB|PB)$"
+                        },
+                        "max_size": {
+                            "type": "string",
+                            "pattern": "^\\d+(B|KB|MB|GB|TB|PB)$"
+                        },
                         "users": {
                             "type": "array",
                             "items": {"type": "string"}
@@ -78,8 +139,12 @@ def humanize_error(error):
     elif error.validator == 'required':
         return f"Missing required field '{error.validator_value[0]}' in section '{'.'.join(error.path)}'."
     elif error.validator == 'pattern':
-        if 'size' in error.path:
+        if any(field in error.path for field in ('size', 'grow_step', 'max_size', 'rbps', 'wbps')):
             return f"Invalid size format '{error.instance}' in section '{'.'.join(error.path)}'. Use 'number+unit' format (e.g., '1GB')."
+    elif error.validator == 'enum':
+        return f"Invalid value '{error.instance}' in field '{'.'.join(error.path)}'. Allowed values: {', '.join(map(str, error.validator_value))}."
+    elif error.validator == 'oneOf' and 'auto_resize' in error.path:
+        return f"Invalid value '{error.instance}' in field '{'.'.join(error.path)}'. Allowed values: true, false, grow, shrink, both."
     elif error.validator == 'anyOf':
         return f"Section '{'.'.join(error.path)}' must have at least one of the fields: 'users' or 'groups'."
     return str(error)
@@ -92,6 +157,55 @@ APP_CONFIG = {
     "netbios_name": os.environ.get("NETBIOS_NAME", "SAMBA"),
     "min_protocol": os.environ.get("MIN_PROTOCOL", "SMB2"),
     "max_protocol": os.environ.get("MAX_PROTOCOL", "SMB3"),
+    "max_tracked_objects": int(os.environ.get("MONITOR_MAX_TRACKED", "10000")),
+    "profiling": os.environ.get("SMBD_PROFILING", "false").lower() == "true",
+    "profile_history": int(os.environ.get("PROFILE_HISTORY", "360")),
+    "supervise": os.environ.get("SMBD_SUPERVISE", "false").lower() == "true",
+    "smbd_ready_timeout": float(os.environ.get("SMBD_READY_TIMEOUT", "30")),
+    "perf_profile": os.environ.get("SAMBA_PERF_PROFILE", "default"),
+}
+
+MONITOR_CONFIG = {
+    "min_delay": float(os.environ.get("MONITOR_MIN_INTERVAL", "1")),
+    "max_delay": float(os.environ.get("MONITOR_MAX_INTERVAL", "30")),
+    "timeout": float(os.environ.get("MONITOR_TIMEOUT", "10")),
+    "report_interval": float(os.environ.get("MONITOR_REPORT_INTERVAL", "600")),
+}
+
+PROFILING_CONFIG = {
+    "interval": float(os.environ.get("PROFILE_INTERVAL", "10")),
+}
+
+METRICS_CONFIG = {
+    "port": int(os.environ.get("METRICS_PORT", "0")),
+    "refresh_interval": float(os.environ.get("METRICS_REFRESH_INTERVAL", "15")),
+}
+
+PROVISION_CONFIG = {
+    "workers": int(os.environ.get("PROVISION_WORKERS", "4")),
+}
+
+AUTOGROW_CONFIG = {
+    "min_interval": float(os.environ.get("AUTOGROW_MIN_INTERVAL", "5")),
+    "max_interval": float(os.environ.get("AUTOGROW_MAX_INTERVAL", "300")),
+}
+
+WATCHER_CONFIG = {
+    "interval": float(os.environ.get("CONFIG_WATCH_INTERVAL", "5")),
+}
+
+SHUTDOWN_CONFIG = {
+    "timeout": float(os.environ.get("SHUTDOWN_TIMEOUT", "8")),
+}
+
+TRIM_CONFIG = {
+    "interval": float(os.environ.get("TRIM_INTERVAL", "86400")),
+    "window": os.environ.get("TRIM_WINDOW", "01:00-06:00"),
+}
+
+RUNTIME_CONFIG = {
+    "async": os.environ.get("ASYNC_RUNTIME", "false").lower() == "true",
+    "heavy_limit": int(os.environ.get("HEAVY_COMMAND_LIMIT", "2")),
 }
 
 ################################################################################
@@ -115,11 +229,30 @@ USERS = {}
 GROUPS = {}
 SHARE = {}
 
-def read_config():
+def load_config():
+    """Reads and validates the configuration file. Returns None if it is invalid."""
+    with open(CONFIG_FILENAME) as stream:
+        config = yaml.safe_load(stream)
+
+    try:
+        validate(instance=config, schema=SCHEMA)
+    except ValidationError as e:
+        print(humanize_error(e))
+        return None
+
+    return config
+
+def apply_config(config):
     global CONFIG
     global USERS
     global GROUPS
     global SHARE
+    CONFIG  = config
+    USERS   = CONFIG["users"] if "users" in CONFIG else {}
+    GROUPS  = CONFIG["groups"] if "groups" in CONFIG else {}
+    SHARE   = CONFIG["share"] if "share" in CONFIG else {}
+
+def read_config():
     if not os.path.exists(CONFIG_FILENAME):
         os.makedirs(os.path.dirname(CONFIG_FILENAME), exist_ok=True)
         with open(CONFIG_FILENAME, 'w') as outfile:
@@ -127,19 +260,25 @@ def read_config():
         print(f"Configuration file '{CONFIG_FILENAME}' has been created. Please configure it and run the program again.")
         return False
 
-    with open(CONFIG_FILENAME) as stream:
-        CONFIG = yaml.safe_load(stream)
+    config = load_config()
+    if config is None:
+        return False
 
+    apply_config(config)
+    return True
+
+def reload_config():
+    """Re-reads the configuration at runtime. The current one is kept if the new file is invalid."""
     try:
-        validate(instance=CONFIG, schema=SCHEMA)
-    except ValidationError as e:
-        print(humanize_error(e))
+        config = load_config()
+    except (OSError, yaml.YAMLError) as e:
+        print(f"Failed to read '{CONFIG_FILENAME}': {e}")
         return False
 
-    USERS   = CONFIG["users"] if "users" in CONFIG else {}
-    GROUPS  = CONFIG["groups"] if "groups" in CONFIG else {}
-    SHARE   = CONFIG["share"] if "share" in CONFIG else {}
+    if config is None:
+        return False
 
+    apply_config(config)
     return True
 
 if __name__ == "__main__":
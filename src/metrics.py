@@ -0,0 +1,214 @@
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from shell import Shell, CommandStats
+from VirtualDisk import IO_LIMITER
+
+PREFIX = "samba_vd"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class MetricsRegistry:
+    """Сборка метрик в текстовом формате Prometheus"""
+    def __init__(self):
+        self._metrics = {}
+
+    def add(self, name, metric_type, help_text, value, suffix="", **labels):
+        name = f"{PREFIX}_{name}"
+        metric = self._metrics.setdefault(name, {"type": metric_type, "help": help_text, "samples": []})
+        metric["samples"].append((suffix, labels, value))
+
+    def add_histogram(self, name, help_text, bounds, counts, total, count, **labels):
+        """counts - количество наблюдений в каждом интервале (последний - выше всех границ)"""
+        cumulative = 0
+        for bound, bucket_count in zip(bounds, counts):
+            cumulative += bucket_count
+            self.add(name, "histogram", help_text, cumulative, suffix="_bucket", le=bound, **labels)
+        self.add(name, "histogram", help_text, count, suffix="_bucket", le="+Inf", **labels)
+        self.add(name, "histogram", help_text, f"{total:.6f}", suffix="_sum", **labels)
+        self.add(name, "histogram", help_text, count, suffix="_count", **labels)
+
+    def render(self):
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for suffix, labels, value in metric["samples"]:
+                if labels:
+                    label_text = ",".join(f'{key}="{escape_label(label)}"' for key, label in sorted(labels.items()))
+                    lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+                else:
+                    lines.append(f"{name}{suffix} {value}")
+        return "\n".join(lines) + "\n"
+
+class MetricsExporter:
+    """HTTP-эндпоинт /metrics.
+
+    Значения собираются фоновым потоком раз в refresh_interval секунд из
+    объектов Samba/VirtualDisk (без запуска процессов); запрос отдает
+    последний собранный текст.
+    """
+    def __init__(self, samba, provisioner, disks, trim_scheduler=None, port=9922, refresh_interval=15):
+        self.samba = samba
+        self.provisioner = provisioner
+        self.disks = disks
+        self.trim_scheduler = trim_scheduler
+        self.port = port
+        self.refresh_interval = refresh_interval
+        self._text = ""
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+
+    def _collect_samba(self, registry):
+        registry.add("sessions", "gauge", "Active SMB sessions", len(self.samba.sessions))
+        registry.add("tcons", "gauge", "Active tree connections", len(self.samba.tcons))
+        registry.add("open_files", "gauge", "Open files", len(self.samba.open_files))
+
+        for object_type, tracker in (("sessions", self.samba.sessions), ("tcons", self.samba.tcons), ("open_files", self.samba.open_files)):
+            registry.add("tracking_dropped", "gauge", "Objects not tracked because of the tracking limit", tracker.dropped, type=object_type)
+
+        for share, counters in dict(self.samba.share_stats).items():
+            registry.add("share_tcons", "gauge", "Active tree connections per share", counters["tcons"], share=share)
+            registry.add("share_open_files", "gauge", "Open files per share", counters["open_files"], share=share)
+
+        for user, counters in dict(self.samba.user_stats).items():
+            registry.add("user_sessions", "gauge", "Active SMB sessions per user", counters["sessions"], user=user)
+            registry.add("user_tcons", "gauge", "Active tree connections per user", counters["tcons"], user=user)
+            registry.add("user_open_files", "gauge", "Open files per user", counters["open_files"], user=user)
+
+        if self.samba.supervise:
+            registry.add("smbd_up", "gauge", "Supervised smbd process is running", int(self.samba.smbd_supervised()))
+            registry.add("smbd_restarts_total", "counter", "Restarts of the supervised smbd after a crash", self.samba.smbd_restarts)
+
+        stats = dict(self.samba.monitor_stats)
+        registry.add("monitor_polls_total", "counter", "smbstatus polls", stats["polls"])
+        registry.add("monitor_errors_total", "counter", "Failed smbstatus polls", stats["errors"])
+        registry.add("monitor_status_seconds_total", "counter", "Time spent in smbstatus", f"{stats['status_seconds']:.6f}")
+        registry.add("monitor_interval_seconds", "gauge", "Current smbstatus poll interval", stats["delay"])
+
+    def _collect_throughput(self, registry):
+        if not self.samba.profile_history:
+            return
+        sample = self.samba.profile_history[-1]
+        registry.add("read_bytes_per_second", "gauge", "SMB2 read throughput over the last profiling interval", f"{sample.read_bytes_per_sec:.1f}")
+        registry.add("write_bytes_per_second", "gauge", "SMB2 write throughput over the last profiling interval", f"{sample.write_bytes_per_sec:.1f}")
+        for operation, rate in sample.ops_per_sec.items():
+            registry.add("smb2_operations_per_second", "gauge", "SMB2 operation rate over the last profiling interval", f"{rate:.2f}", operation=operation)
+
+    def _collect_disks(self, registry):
+        for share, disk in dict(self.disks).items():
+            try:
+                stat = os.stat(disk.disk_image)
+                info = disk.get_disk_info()
+            except Exception:
+                registry.add("share_up", "gauge", "Share disk is available and mounted", 0, share=share)
+                continue
+
+            registry.add("share_up", "gauge", "Share disk is available and mounted", int(info["mounted"]), share=share)
+            registry.add("image_apparent_bytes", "gauge", "Apparent size of the disk image", stat.st_size, share=share)
+            registry.add("image_allocated_bytes", "gauge", "Space allocated on the host for the disk image", stat.st_blocks * 512, share=share)
+
+            for usage in list(info["usage"].values())[:1]:
+                registry.add("share_total_bytes", "gauge", "Filesystem size of the share", usage["total_bytes"], share=share)
+                registry.add("share_used_bytes", "gauge", "Used space of the share", usage["used_bytes"], share=share)
+                registry.add("share_free_bytes", "gauge", "Free space of the share", usage["free_bytes"], share=share)
+
+    def _collect_io_limits(self, registry):
+        devices, pressure = IO_LIMITER.state()
+        if not devices:
+            return
+        for share, disk in dict(self.disks).items():
+            for loop_device in list(disk.loop_devices):
+                if loop_device not in devices:
+                    continue
+                limits, stats = devices[loop_device]["limits"], devices[loop_device]["stats"]
+                for limit in IO_LIMITER.KEYS:
+                    if limits.get(limit) is not None:
+                        registry.add("io_limit", "gauge", "cgroup io.max limit of the share loop device (bytes or operations per second)", limits[limit], share=share, limit=limit)
+                registry.add("io_bytes_total", "counter", "Bytes transferred by smbd on the share loop device", stats.get("rbytes", 0), share=share, direction="read")
+                registry.add("io_bytes_total", "counter", "Bytes transferred by smbd on the share loop device", stats.get("wbytes", 0), share=share, direction="write")
+                registry.add("io_operations_total", "counter", "I/O operations issued by smbd on the share loop device", stats.get("rios", 0), share=share, direction="read")
+                registry.add("io_operations_total", "counter", "I/O operations issued by smbd on the share loop device", stats.get("wios", 0), share=share, direction="write")
+
+        for kind, values in pressure.items():
+            if "avg10" in values:
+                registry.add("io_pressure_avg10", "gauge", "Share of the last 10s smbd was stalled on I/O, percent", values["avg10"], kind=kind)
+
+    def _collect_trim(self, registry):
+        if self.trim_scheduler is None:
+            return
+        for share, stats in dict(self.trim_scheduler.reclaimed).items():
+            registry.add("trim_reclaimed_bytes_total", "counter", "Host space reclaimed by fstrim of the share", stats["total"], share=share)
+            registry.add("trim_last_reclaimed_bytes", "gauge", "Host space reclaimed by the last fstrim of the share", stats["last"], share=share)
+            registry.add("trim_last_timestamp_seconds", "gauge", "Time of the last fstrim of the share", f"{stats['timestamp']:.0f}", share=share)
+
+    def _collect_commands(self, registry):
+        with Shell._stats_lock:
+            stats = [(name, CommandStats.BUCKETS, list(command_stats.buckets), command_stats.total, command_stats.count, command_stats.failures)
+                     for name, command_stats in Shell.command_stats.items()]
+
+        for name, bounds, counts, total, count, failures in stats:
+            registry.add_histogram("command_duration_seconds", "Duration of external commands", bounds, counts, total, count, command=name)
+            registry.add("command_failures_total", "counter", "External commands that failed or timed out", failures, command=name)
+
+    def _collect_provisioning(self, registry):
+        registry.add("provision_seconds", "gauge", "Wall time of the last share provisioning", f"{self.provisioner.provision_elapsed:.3f}")
+        for phase, duration in dict(self.provisioner.phase_durations).items():
+            registry.add("provision_phase_seconds", "gauge", "Time spent in a provisioning phase, summed over shares", f"{duration:.3f}", phase=phase)
+
+    def collect(self):
+        registry = MetricsRegistry()
+        for collector in (self._collect_samba, self._collect_throughput, self._collect_disks, self._collect_io_limits, self._collect_trim, self._collect_commands, self._collect_provisioning):
+            try:
+                collector(registry)
+            except Exception as e:
+                print(f"Failed to collect metrics: {e}")
+        registry.add("last_refresh_timestamp_seconds", "gauge", "Time of the last metrics refresh", f"{time.time():.0f}")
+        return registry.render()
+
+    def _refresh_loop(self):
+        while True:
+            self._text = self.collect()
+            if self._stop.wait(self.refresh_interval):
+                break
+
+    def _handler(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = exporter._text.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        if not self.port or self._server is not None:
+            return
+        self._server = ThreadingHTTPServer(("", self.port), self._handler())
+        self._server.daemon_threads = True
+        for target, name in ((self._refresh_loop, "metrics-refresh"), (self._server.serve_forever, "metrics-http")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Metrics are available on port {self.port}")
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
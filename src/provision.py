@@ -0,0 +1,301 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from VirtualDisk import VirtualDisk, VirtualDiskError
+
+################################################################################
+
+def convert_to_mb(size, unit):
+    unit = unit.upper()
+
+    conversion_factors = {
+        'B': 1 / (1024 * 1024),
+        'KB': 1 / 1024,
+        'MB': 1,
+        'GB': 1024,
+        'TB': 1024 * 1024,
+        'PB': 1024 * 1024 * 1024
+    }
+
+    if unit not in conversion_factors:
+        raise ValueError(f"Unsupported unit: {unit}. Supported units are: B, KB, MB, GB, TB, PB")
+
+    return size * conversion_factors[unit]
+
+def convert_to_mb_auto(size_str):
+    match = re.match(r'^([\d.]+)\s*([A-Za-z]+)$', size_str.strip())
+    if not match:
+        raise ValueError("Invalid size format. Expected format like '500KB' or '2GB'")
+
+    size = float(match.group(1))
+    unit = match.group(2).upper()
+
+    return convert_to_mb(size, unit)
+
+def io_limits_from_conf(conf):
+    """Ограничения io_limits из конфига шары в байтах и операциях в секунду"""
+    limits = {}
+    for key in ("rbps", "wbps"):
+        if key in (conf or {}):
+            limits[key] = int(convert_to_mb_auto(conf[key]) * 1024 * 1024)
+    for key in ("riops", "wiops"):
+        if key in (conf or {}):
+            limits[key] = conf[key]
+    return limits
+
+################################################################################
+
+class ShareResult:
+    """Результат подготовки одной шары"""
+    def __init__(self, key):
+        self.key = key
+        self.action = "provision"
+        self.disk = None
+        self.disk_info = None
+        self.error = None
+        self.timings = {}
+        # Освобождено на хосте уменьшением образа (байт)
+        self.reclaimed = 0
+
+class Provisioner:
+    PHASES = ("create", "unmount", "resize", "shrink", "mount", "info")
+    GROW_POLICIES = (True, "grow", "both")
+    SHRINK_POLICIES = ("shrink", "both")
+
+    def __init__(self, disks_path, mount_path, workers=4, debug=False):
+        self.disks_path = disks_path
+        self.mount_path = mount_path
+        self.workers = max(1, workers)
+        self.debug = debug
+        self.elapsed = 0.0
+        # Длительность последней непустой подготовки и суммарная длительность ее фаз
+        self.provision_elapsed = 0.0
+        self.phase_durations = {}
+        # Диски шар, подготовка которых идет сейчас (освобождаются при остановке)
+        self.active = {}
+        # Шары, о невозможности уменьшения которых уже предупредили
+        self._shrink_warned = set()
+
+    def _timed(self, result, phase, func, *args):
+        start = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            result.timings[phase] = result.timings.get(phase, 0.0) + time.monotonic() - start
+
+    def image_path(self, key, share_conf):
+        return os.path.join(self.disks_path, share_conf.get("filename", key + ".img"))
+
+    def mount_point(self, key):
+        return os.path.join(self.mount_path, key)
+
+    def should_shrink(self, key, share_conf, disk):
+        """Нужно ли уменьшать образ диска до заданного в конфиге размера"""
+        if share_conf.get("auto_resize", True) not in self.SHRINK_POLICIES:
+            return False
+        # Шара с автоувеличением может законно превышать заданный размер
+        if "grow_at_percent" in share_conf:
+            return False
+        info = disk.get_disk_info()
+        if info["size_mb"] <= int(convert_to_mb_auto(share_conf["size"])):
+            return False
+        # Проверяется до отмонтирования и отключения клиентов
+        if not info["filesystem"].startswith("ext"):
+            if key not in self._shrink_warned:
+                self._shrink_warned.add(key)
+                print(f"Disk {key} has {info['filesystem']} filesystem, only ext can be shrunk. Keeping {info['size_mb']}MB")
+            return False
+        return True
+
+    @staticmethod
+    def needs_fresh_mount(share_conf, applied_options):
+        """Сняты ли ранее примененные опции монтирования. remount их не сбрасывает -
+        шару нужно отмонтировать и смонтировать заново"""
+        if applied_options is None:
+            return False
+        return not set(applied_options) <= set(share_conf.get("mount_options") or [])
+
+    def provision_share(self, key, share_conf, applied_options=None):
+        """Создание, изменение размера и монтирование диска одной шары.
+        applied_options - опции монтирования, примененные прошлым запуском"""
+        result = ShareResult(key)
+        try:
+            disk = VirtualDisk(
+                self.image_path(key, share_conf),
+                debug           = self.debug,
+                loop_options    = share_conf.get("loop"),
+                io_limits       = io_limits_from_conf(share_conf.get("io_limits")),
+                mount_options   = share_conf.get("mount_options")
+            )
+            self.active[key] = disk
+            disk_size = int(convert_to_mb_auto(share_conf["size"]))
+
+            filesystem = share_conf.get("filesystem", "ext4")
+            if not os.path.exists(disk.disk_image) and share_conf.get("template"):
+                template = os.path.join(self.disks_path, share_conf["template"])
+                self._timed(result, "create", disk.create_from_template, template)
+                print(f"Disk {key} created from template '{share_conf['template']}'.")
+            elif not os.path.exists(disk.disk_image):
+                self._timed(
+                    result, "create", disk.create,
+                    disk_size, filesystem, share_conf.get("preallocation", "full"), share_conf.get("mkfs_options")
+                )
+                print(f"Disk {key} created.")
+            else:
+                print(f"Disk {key} exist. Skipping")
+                current = disk.get_disk_info()["filesystem"]
+                if current != filesystem:
+                    print(f"Disk {key} has {current} filesystem, not {filesystem}. The image is not reformatted")
+
+            mount_point = self.mount_point(key)
+            for point in self._timed(result, "unmount", disk.get_mount_points):
+                if point == mount_point:
+                    continue
+                try:
+                    print(f"Removing mount point '{point}' for '{key}'")
+                    self._timed(result, "unmount", disk.unmount, point)
+                except Exception as e:
+                    print(e)
+
+            size_mb = disk.get_disk_info()["size_mb"]
+            policy = share_conf.get("auto_resize", True)
+            grow = size_mb < disk_size and policy in self.GROW_POLICIES
+            shrink = self.should_shrink(key, share_conf, disk)
+            if size_mb > disk_size and policy not in self.SHRINK_POLICIES and "grow_at_percent" not in share_conf:
+                print(f"Disk {key} is larger than configured ({size_mb}MB > {disk_size}MB). Set auto_resize to 'shrink' or 'both' to shrink it")
+
+            mounted = mount_point in disk.get_mount_points()
+            if shrink:
+                # Уменьшение возможно только офлайн
+                print(f"Shrink {key} offline ({size_mb}MB => {disk_size}MB)")
+                try:
+                    if mounted:
+                        self._timed(result, "unmount", disk.unmount, mount_point)
+                    result.reclaimed = self._timed(result, "shrink", disk.shrink, disk_size)
+                    print(f"Disk {key} shrunk, {result.reclaimed / 1024 ** 2:.1f} MB reclaimed on the host")
+                except VirtualDiskError as e:
+                    # Шара остается доступной в прежнем размере
+                    print(f"Failed to shrink {key}: {e}")
+                mounted = mount_point in disk.get_mount_points()
+
+            if grow and not mounted and disk.needs_check():
+                # Файловую систему нужно проверить до монтирования - увеличиваем офлайн
+                print(f"Resize {key} offline ({size_mb}MB => {disk_size}MB)")
+                self._timed(result, "resize", disk.resize, disk_size)
+                grow = False
+
+            if mounted and self.needs_fresh_mount(share_conf, applied_options):
+                print(f"Mount options of {key} removed. Mounting it again with {', '.join(disk.mount_options) or 'default options'}")
+                try:
+                    self._timed(result, "unmount", disk.unmount, mount_point)
+                except VirtualDiskError as e:
+                    print(e)
+                mounted = mount_point in disk.get_mount_points()
+
+            if not mounted:
+                self._timed(result, "mount", disk.mount, mount_point)
+            elif disk.mount_options and list(disk.mount_options) != list(applied_options or []):
+                # Шара уже смонтирована - новые опции применяются перемонтированием
+                try:
+                    self._timed(result, "mount", disk.remount, mount_point)
+                except VirtualDiskError as e:
+                    # Шара остается доступной с прежними опциями
+                    print(f"Failed to apply mount options of {key}: {e}")
+
+            if grow:
+                print(f"Resize {key} ({size_mb}MB => {disk_size}MB)")
+                try:
+                    self._timed(result, "resize", disk.resize, disk_size)
+                except VirtualDiskError as e:
+                    # Шара остается доступной в прежнем размере
+                    print(f"Failed to grow {key}: {e}")
+
+            result.disk_info = self._timed(result, "info", disk.get_disk_info)
+            result.disk = disk
+        except Exception as e:
+            result.error = e
+        finally:
+            self.active.pop(key, None)
+        return result
+
+    def provision(self, shares, applied_options=None):
+        """Параллельная подготовка шар. Результаты возвращаются в порядке конфига"""
+        applied_options = applied_options or {}
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.provision_share, key, shares[key], applied_options.get(key)) for key in shares]
+            results = [future.result() for future in futures]
+        self.elapsed = time.monotonic() - start
+        if not results:
+            return results
+
+        self.phase_durations = {}
+        self.provision_elapsed = self.elapsed
+        for result in results:
+            for phase, duration in result.timings.items():
+                self.phase_durations[phase] = self.phase_durations.get(phase, 0.0) + duration
+        return results
+
+    def release_share(self, key, disk, timeout=None):
+        """Отмонтирование диска шары и отключение его loop-устройств"""
+        result = ShareResult(key)
+        result.action = "release"
+        result.disk = disk
+        try:
+            self._timed(result, "unmount", disk.release, timeout)
+        except Exception as e:
+            result.error = e
+        return result
+
+    def release(self, disks, deadline):
+        """Параллельное освобождение дисков {шара: диск} с ограничением по времени.
+        Не успевшие шары возвращаются с ошибкой TimeoutError"""
+        start = time.monotonic()
+        results = {key: None for key in disks}
+
+        def worker(key, disk):
+            results[key] = self.release_share(key, disk, timeout=deadline)
+
+        # Потоки-демоны не задерживают выход процесса по истечении срока
+        threads = [threading.Thread(target=worker, args=(key, disk), name=f"release-{key}", daemon=True) for key, disk in disks.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(max(0.0, deadline - (time.monotonic() - start)))
+
+        for key, result in results.items():
+            if result is None:
+                result = results[key] = ShareResult(key)
+                result.action = "release"
+                result.error = TimeoutError(f"not released within {deadline:.0f}s")
+                result.timings["unmount"] = time.monotonic() - start
+        self.elapsed = time.monotonic() - start
+        return list(results.values())
+
+    def print_release_summary(self, results):
+        failed = [result for result in results if result.error is not None]
+        print(f"Released {len(results) - len(failed)}/{len(results)} shares in {self.elapsed:.2f}s")
+        for result in results:
+            status = f"failed: {result.error}" if result.error is not None else "ok"
+            print(f"  • {result.key:<16} {result.timings.get('unmount', 0.0):8.2f}s  {status}")
+
+    def print_summary(self, results):
+        failed = [result for result in results if result.error is not None]
+        kept = [result for result in results if result.action == "keep"]
+
+        print(f"Provisioned {len(results) - len(failed)}/{len(results)} shares in {self.elapsed:.2f}s ({self.workers} workers, {len(kept)} unchanged)")
+        reclaimed = sum(result.reclaimed for result in results)
+        if reclaimed:
+            print(f"  • reclaimed {reclaimed / 1024 ** 2:.1f} MB on the host by shrinking images")
+        for phase in self.PHASES:
+            durations = [result.timings[phase] for result in results if phase in result.timings]
+            if not durations:
+                continue
+            print(f"  • {phase:<8} total {sum(durations):8.2f}s  max {max(durations):8.2f}s  ({len(durations)} shares)")
+
+        for result in failed:
+            print(f"  ! {result.key}: {result.error}")
+        print()
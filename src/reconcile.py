@@ -0,0 +1,238 @@
+import os
+import threading
+
+from VirtualDisk import VirtualDisk, MOUNT_TABLE, LOOP_REGISTRY
+from provision import ShareResult, convert_to_mb_auto, io_limits_from_conf
+
+class Reconciler:
+    """Применяет только те изменения, которые отличаются от состояния прошлого запуска"""
+    def __init__(self, samba, provisioner, state, debug=False):
+        self.samba = samba
+        self.provisioner = provisioner
+        self.state = state
+        self.debug = debug
+        self.disks = {}
+        # Общая блокировка операций с дисками (перезагрузка конфига, автоувеличение)
+        self.lock = threading.RLock()
+
+    def refresh(self):
+        """Перечитывание таблиц монтирования и loop-устройств (могли измениться извне)"""
+        MOUNT_TABLE.invalidate()
+        LOOP_REGISTRY.invalidate()
+
+    ############################################################################
+
+    def apply_users(self, users):
+        """Создание/обновление изменившихся пользователей и удаление лишних"""
+        applied = self.state.users
+        changed = 0
+
+        for username in list(applied):
+            if username in users:
+                continue
+            try:
+                self.samba.delete_samba_user(username)
+                print(f"User '{username}' removed from Samba")
+            except Exception as e:
+                print(e)
+            applied.pop(username)
+            changed += 1
+
+        pending = {}
+        for username, password in users.items():
+            if self.samba.linux_user_exists(username) and self.state.verify_secret(password, applied.get(username)):
+                continue
+            pending[username] = password
+
+        failed = self._apply_users_bulk(pending) if pending else set()
+        for username, password in pending.items():
+            if username in failed:
+                applied.pop(username, None)
+                continue
+            applied[username] = self.state.hash_secret(password)
+            changed += 1
+
+        return changed
+
+    def _apply_users_bulk(self, users):
+        """Пакетное применение пользователей: newusers/chpasswd и импорт в pdbedit.
+        Возвращает имена пользователей, которые применить не удалось"""
+        # Формат newusers не допускает ":" в пароле - такие пользователи создаются по одному
+        failed = self._apply_users_one_by_one({username: password for username, password in users.items() if ":" in password})
+        users = {username: password for username, password in users.items() if ":" not in password}
+        if not users:
+            return failed
+
+        missing = {username: password for username, password in users.items() if not self.samba.linux_user_exists(username)}
+        existing = {username: password for username, password in users.items() if username not in missing}
+        try:
+            self.samba.create_linux_users(missing)
+            self.samba.set_linux_passwords(existing)
+
+            samba_users = self.samba.samba_users()
+            self.samba.import_samba_users({username: password for username, password in users.items() if username not in samba_users})
+            for username in samba_users.intersection(users):
+                self.samba.set_samba_password(username, users[username])
+        except Exception as e:
+            print(f"Bulk user update failed ({e}). Applying users one by one")
+            return failed | self._apply_users_one_by_one(users)
+        return failed
+
+    def _apply_users_one_by_one(self, users):
+        failed = set()
+        for username, password in users.items():
+            try:
+                if self.samba.linux_user_exists(username):
+                    self.samba.set_linux_password(username, password)
+                else:
+                    self.samba.create_linux_user(username, password)
+                self.samba.create_samba_user(username, password)
+            except Exception as e:
+                print(f"Failed to apply user '{username}': {e}")
+                failed.add(username)
+        return failed
+
+    ############################################################################
+
+    def _share_record(self, key, share_conf):
+        """Параметры шары, влияющие на диск"""
+        record = {
+            "image": self.provisioner.image_path(key, share_conf),
+            "mount_point": self.provisioner.mount_point(key),
+            "size_mb": int(convert_to_mb_auto(share_conf["size"])),
+            "auto_resize": share_conf.get("auto_resize", True),
+            "preallocation": share_conf.get("preallocation", "full"),
+        }
+        # Ключ добавляется только при наличии опций, чтобы не менять записи существующих шар
+        if share_conf.get("mount_options"):
+            record["mount_options"] = list(share_conf["mount_options"])
+        return record
+
+    def _applied_mount_options(self, key):
+        """Опции монтирования, примененные прошлым запуском, или None, если шара не записана"""
+        record = self.state.shares.get(key)
+        if record is None:
+            return None
+        return record.get("config", {}).get("mount_options", [])
+
+    def _keep_share(self, key, share_conf):
+        """Возвращает результат для шары, если она уже в нужном состоянии, иначе None"""
+        record = self.state.shares.get(key)
+        desired = self._share_record(key, share_conf)
+        if not record or record.get("config") != desired or not os.path.exists(desired["image"]):
+            return None
+
+        disk = VirtualDisk(
+            desired["image"],
+            debug           = self.debug,
+            filesystem      = record.get("filesystem"),
+            loop_options    = share_conf.get("loop"),
+            io_limits       = io_limits_from_conf(share_conf.get("io_limits")),
+            mount_options   = share_conf.get("mount_options")
+        )
+        if disk.get_mount_points() != [desired["mount_point"]]:
+            return None
+
+        # Параметры loop-устройства и ограничения ввода-вывода меняются без перемонтирования
+        try:
+            disk.apply_loop_options()
+        except Exception as e:
+            print(f"Warning: {e}")
+        disk.apply_io_limits()
+
+        result = ShareResult(key)
+        result.action = "keep"
+        result.disk = disk
+        result.disk_info = disk.get_disk_info()
+        return result
+
+    def _record_share(self, key, share_conf, result):
+        self.state.shares[key] = {
+            "config": self._share_record(key, share_conf),
+            "filesystem": result.disk_info["filesystem"],
+            "loop_devices": list(result.disk.loop_devices),
+            "mount_points": list(result.disk_info["mount_points"]),
+        }
+
+    def remove_share(self, key):
+        """Отмонтирование шары, удаленной из конфига. Образ диска не удаляется"""
+        record = self.state.shares.get(key, {})
+        image = record.get("config", {}).get("image")
+        disk = self.disks.pop(key, None)
+        if disk is None and image and os.path.exists(image):
+            disk = VirtualDisk(image, debug=self.debug)
+
+        if disk is not None:
+            for point in disk.get_mount_points():
+                print(f"Removing mount point '{point}' for '{key}'")
+                disk.unmount(point)
+
+        self.state.shares.pop(key, None)
+
+    def plan_shares(self, shares):
+        """Разделение шар на неизменные, требующие подготовки и удаленные"""
+        kept = {}
+        pending = {}
+        for key, share_conf in shares.items():
+            try:
+                result = self._keep_share(key, share_conf)
+            except Exception:
+                result = None
+
+            if result is not None:
+                kept[key] = result
+            else:
+                pending[key] = share_conf
+
+        removed = [key for key in self.state.shares if key not in shares]
+        return kept, pending, removed
+
+    def affected_shares(self, shares, pending, removed):
+        """Уже опубликованные шары, которые будут отмонтированы при применении плана.
+
+        Увеличение выполняется онлайн, поэтому клиенты отключаются только
+        при удалении шары, смене ее образа/точки монтирования, уменьшении
+        или снятии опций монтирования.
+        """
+        affected = []
+        for key in self.disks:
+            if key in removed:
+                affected.append(key)
+            elif key in pending:
+                record = self.state.shares.get(key, {}).get("config", {})
+                desired = self._share_record(key, shares[key])
+                if record.get("image") != desired["image"] or record.get("mount_point") != desired["mount_point"]:
+                    affected.append(key)
+                elif self._will_shrink(key, shares[key]):
+                    affected.append(key)
+                elif self.provisioner.needs_fresh_mount(shares[key], self._applied_mount_options(key)):
+                    affected.append(key)
+        return affected
+
+    def _will_shrink(self, key, share_conf):
+        try:
+            return self.provisioner.should_shrink(key, share_conf, self.disks[key])
+        except Exception:
+            return False
+
+    def apply_shares(self, shares, kept, pending, removed):
+        """Применение плана. Результаты возвращаются в порядке конфига"""
+        for key in removed:
+            try:
+                self.remove_share(key)
+            except Exception as e:
+                print(f"Failed to remove share '{key}': {e}")
+
+        applied_options = {key: self._applied_mount_options(key) for key in pending}
+        provisioned = {result.key: result for result in self.provisioner.provision(pending, applied_options)}
+
+        results = []
+        for key, share_conf in shares.items():
+            result = kept[key] if key in kept else provisioned[key]
+            if result.error is None:
+                self.disks[key] = result.disk
+                self._record_share(key, share_conf, result)
+            else:
+                self.state.shares.pop(key, None)
+            results.append(result)
+        return results
@@ -0,0 +1,33 @@
+import asyncio
+from shell import AsyncShell
+
+class AsyncRuntime:
+    """Фоновые задачи в одном цикле событий вместо отдельных потоков.
+
+    Мониторинг smbstatus запускает процессы через AsyncShell, проверки
+    заполнения и применение конфигурации (блокирующие операции с дисками)
+    выполняются в пуле потоков.
+    """
+    def __init__(self, samba, usage_watcher, config_watcher, monitor_config):
+        self.samba = samba
+        self.usage_watcher = usage_watcher
+        self.config_watcher = config_watcher
+        self.monitor_config = monitor_config
+        self.shell = AsyncShell(debug=samba.debug)
+
+    async def run(self):
+        tasks = [
+            asyncio.create_task(self.samba.monitor_async(self.shell, **self.monitor_config), name="monitor"),
+            asyncio.create_task(self.usage_watcher.run_async(), name="usage-watcher"),
+            asyncio.create_task(self.config_watcher.run_async(), name="config-watcher"),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Отмена задач завершает и запущенные ими процессы
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def start(self):
+        asyncio.run(self.run())
@@ -1,9 +1,16 @@
 import subprocess
+import time
 import os
+import pwd
+import tempfile
 from pathlib import Path
 from shell import Shell
+from .passdb import smbpasswd_line
+from .profiles import PROFILES, global_settings, share_settings
 from .configure import SambaConfigure
 from .logger import SambaLogger
+from .profiler import SambaProfiler
+from .supervisor import SambaSupervisor
 
 class SambaError(Exception):
     def __init__(self, message):
@@ -13,7 +20,7 @@ class SambaError(Exception):
     def __str__(self):
         return f"{self.message}"
 
-class Samba(SambaConfigure, SambaLogger):
+class Samba(SambaConfigure, SambaLogger, SambaProfiler, SambaSupervisor):
     shares = []
     def __init__(self,
         debug=False,
@@ -21,57 +28,130 @@ class Samba(SambaConfigure, SambaLogger):
         max_protocol="SMB3",
         server_name="Samba Server",
         netbios_name="SAMBA",
-        perf_settings=None
+        perf_settings=None,
+        perf_profile="default",
+        max_tracked_objects=10000,
+        profiling=False,
+        profile_history=360,
+        supervise=False,
+        smbd_ready_timeout=30
     ):
         self.moduleName = "Samba"
         self.debug = debug
+        self.shares = []
+        self._init_tracking(max_tracked_objects)
+        self._init_profiling(profiling, profile_history)
+        self._init_supervisor(supervise, smbd_ready_timeout)
 
         self.min_protocol = min_protocol
         self.max_protocol = max_protocol
         self.server_name = server_name
         self.netbios_name = netbios_name
 
-        # Стандартные настройки производительности (если не переданы)
-        self.perf_settings = perf_settings or {
-            "socket options": "TCP_NODELAY IPTOS_LOWDELAY SO_RCVBUF=65536 SO_SNDBUF=65536",
-            "min receivefile size": 16384,
-            "write cache size": 262144,
-            "aio read size": 16384,
-            "aio write size": 16384,
-            "smb2 max read": 8388608,
-            "smb2 max write": 8388608,
-            "smb2 max trans": 8388608,
-            "use sendfile": True,
-            "strict locking": False,
-            "read raw": True,
-            "write raw": True,
-        }
+        # Глобальный профиль производительности задает [global] и параметры шар по умолчанию
+        if perf_profile not in PROFILES:
+            raise SambaError(f"Unknown performance profile '{perf_profile}'. Available: {', '.join(PROFILES)}")
+        self.perf_profile = perf_profile
+        self.perf_settings = perf_settings or global_settings(perf_profile)
 
     def create_linux_user(self, username, password):
         """Создание системного пользователя"""
         try:
             self._run_command(["useradd", "-m", "-s", "/bin/bash", username])
 
-            self._run_command(
-                ["passwd", username],
-                input_text=f"{password}\n{password}\n"
-            )
+            self.set_linux_password(username, password)
         except subprocess.CalledProcessError as e:
             raise SambaError(f"Error creating user: {e}")
 
+    def set_linux_password(self, username, password):
+        """Смена пароля системного пользователя"""
+        self._run_command(
+            ["passwd", username],
+            input_text=f"{password}\n{password}\n",
+            check=False
+        )
+
+    def linux_user_exists(self, username):
+        """Проверка наличия системного пользователя"""
+        try:
+            pwd.getpwnam(username)
+            return True
+        except KeyError:
+            return False
+
     def create_samba_user(self, username, password):
         """Добавление пользователя в Samba"""
         self._run_command(
             ["smbpasswd", "-a", username],
-            input_text=f"{password}\n{password}\n"
+            input_text=f"{password}\n{password}\n",
+            check=False
         )
 
-    def add_share(self, share_name, path, valid_users=None, read_only=False, browsable=True, create_mode="0664", directory_mode="0775"):
+    def create_linux_users(self, users):
+        """Создание системных пользователей одним вызовом newusers. users - {имя: пароль}"""
+        if not users:
+            return
+        lines = "".join(f"{username}:{password}::::/home/{username}:/bin/bash\n" for username, password in users.items())
+        try:
+            self._run_command(["newusers"], input_text=lines)
+        except subprocess.CalledProcessError as e:
+            raise SambaError(f"Error creating users: {e}")
+
+    def set_linux_passwords(self, users):
+        """Смена паролей системных пользователей одним вызовом chpasswd"""
+        if not users:
+            return
+        lines = "".join(f"{username}:{password}\n" for username, password in users.items())
+        try:
+            self._run_command(["chpasswd"], input_text=lines)
+        except subprocess.CalledProcessError as e:
+            raise SambaError(f"Error setting passwords: {e}")
+
+    def samba_users(self):
+        """Имена пользователей в базе Samba"""
+        try:
+            output = self._run_command_output(["pdbedit", "-L"])
+        except subprocess.CalledProcessError as e:
+            raise SambaError(f"Error listing samba users: {e}")
+        return {line.split(":", 1)[0] for line in output.splitlines() if ":" in line}
+
+    def import_samba_users(self, users):
+        """Добавление пользователей в Samba одним проходом pdbedit через файл формата smbpasswd"""
+        if not users:
+            return
+        lines = "".join(f"{smbpasswd_line(username, pwd.getpwnam(username).pw_uid, password)}\n" for username, password in users.items())
+
+        fd, filename = tempfile.mkstemp(prefix="smbpasswd-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(lines)
+            self._run_command(["pdbedit", "-i", f"smbpasswd:{filename}"])
+        except subprocess.CalledProcessError as e:
+            raise SambaError(f"Error importing samba users: {e}")
+        finally:
+            os.unlink(filename)
+
+    def set_samba_password(self, username, password):
+        """Смена пароля существующего пользователя Samba без интерактивного ввода.
+        Пароль передается через stdin: аргументы команды видны другим процессам в /proc"""
+        try:
+            self._run_command(["smbpasswd", "-s", "-a", username], input_text=f"{password}\n{password}\n")
+        except subprocess.CalledProcessError as e:
+            raise SambaError(f"Error setting samba password: {e}")
+
+    def delete_samba_user(self, username):
+        """Удаление пользователя из Samba"""
+        try:
+            self._run_command(["smbpasswd", "-x", username])
+        except subprocess.CalledProcessError as e:
+            raise SambaError(f"Error deleting samba user: {e}")
+
+    def add_share(self, share_name, path, valid_users=None, read_only=False, browsable=True, create_mode="0664", directory_mode="0775", profile=None):
         """Добавление общей папки"""
         if not os.path.exists(path):
             os.makedirs(path, mode=0o775)
 
-        self._run_command(["chmod", "775", path])
+        os.chmod(path, 0o775)
 
         share_config = {
             'path': path,
@@ -85,16 +165,63 @@ class Samba(SambaConfigure, SambaLogger):
             # 'force user': valid_users[0] if valid_users else 'nobody'
         }
 
+        share_config.update(share_settings(profile or self.perf_profile))
+
         if valid_users:
             share_config['valid users'] = ' '.join(valid_users)
 
+        self.remove_share(share_name)
         self.shares.append((share_name, share_config))
 
+    def remove_share(self, share_name):
+        """Удаление общей папки из конфигурации"""
+        self.shares = [share for share in self.shares if share[0] != share_name]
+
+    def clear_shares(self):
+        """Удаление всех общих папок из конфигурации"""
+        self.shares = []
+
     def restart_samba(self):
         """Перезапуск Samba"""
+        if self.supervise:
+            self.stop_samba()
+            self.start_smbd()
+            return
         self._run_command(["systemctl", "restart", "smbd"])
         self._run_command(["systemctl", "enable", "smbd"])
 
-    def stop_samba(self):
-        """Остановка Samba"""
-        self._run_command(["systemctl", "stop", "smbd"])
+    def reload_samba(self):
+        """Применение smb.conf без перезапуска smbd и без разрыва текущих сессий"""
+        self._run_command(["smbcontrol", "smbd", "reload-config"])
+
+    def close_share(self, share_name):
+        """Отключение клиентов от общей папки (перед ее отмонтированием)"""
+        try:
+            self._run_command(["smbcontrol", "smbd", "close-share", share_name])
+        except subprocess.CalledProcessError as e:
+            raise SambaError(f"Error closing share '{share_name}': {e}")
+
+    def stop_samba(self, timeout=None):
+        """Остановка Samba. timeout ограничивает время остановки (в секундах)"""
+        started = time.monotonic()
+        if self.supervise:
+            self.stop_smbd(10 if timeout is None else timeout)
+            # smbd, запущенный не этим процессом (например, до перезапуска контейнера)
+            if self.is_running():
+                remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+                self._run_command(["smbcontrol", "smbd", "shutdown"], check=False, timeout=remaining)
+            return
+        self._run_command(["systemctl", "stop", "smbd"], timeout=timeout)
+
+    def is_running(self):
+        """Проверка, запущен ли smbd (по /proc, без запуска процессов)"""
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/comm") as f:
+                    if f.read().strip() == "smbd":
+                        return True
+            except OSError:
+                continue
+        return False
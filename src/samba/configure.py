@@ -1,6 +1,7 @@
 from shell import Shell
 import subprocess
 import configparser
+import io
 from pathlib import Path
 
 class SambaConfigureError(Exception):
@@ -21,7 +22,7 @@ class SambaConfigure(Shell):
             self._run_command(["cp", self.samba_config, self.backup_config])
 
     def configure_global_settings(self):
-        """Настройка глобальных параметров Samba"""
+        """Настройка глобальных параметров Samba. Возвращает True, если smb.conf изменился"""
         config = configparser.ConfigParser()
 
         # Базовые настройки
@@ -44,16 +45,32 @@ class SambaConfigure(Shell):
                 value = "yes" if value else "no"
             config['global'][key] = str(value)
 
+        # Счетчики профилирования для измерения пропускной способности
+        if self.profiling:
+            config['global']['smbd profiling level'] = 'on'
+
         # Добавляем шары
         for share_name, share_config in self.shares:
             config[share_name] = share_config
 
-        # Сохраняем конфиг
+        # Сохраняем конфиг, только если он изменился
+        buffer = io.StringIO()
+        config.write(buffer)
+        content = buffer.getvalue()
+
+        try:
+            with open(self.samba_config) as f:
+                if f.read() == content:
+                    return False
+        except OSError:
+            pass
+
         with open('/tmp/smb.conf.tmp', 'w') as f:
-            config.write(f)
+            f.write(content)
 
         self._run_command(["mv", "/tmp/smb.conf.tmp", self.samba_config])
         self._run_command(["chmod", "644", self.samba_config])
+        return True
 
     def configure_firewall(self):
         """Настройка фаервола для Samba"""
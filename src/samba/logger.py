@@ -1,69 +1,221 @@
 from datetime import datetime
 import json
 import time
+import asyncio
 from shell import Shell
+from .tracker import ObjectTracker, Session, Tcon, OpenFile
 
 class SambaLogger(Shell):
-    sessions = {}
-    tcons = {}
-    open_files = {}
     def __init__(self):
         pass
 
-    def _get_status_json(self):
-        return json.loads(self._run_command_output(['smbstatus', '-j']))
+    def _init_tracking(self, max_tracked_objects=10000):
+        self.sessions = ObjectTracker('sessions', max_tracked_objects)
+        self.tcons = ObjectTracker('tcons', max_tracked_objects)
+        self.open_files = ObjectTracker('open_files', max_tracked_objects)
+        # Счетчики активных объектов по шарам и пользователям
+        self.share_stats = {}
+        self.user_stats = {}
+        self._reported_drops = {}
+        self.monitor_stats = {
+            'polls': 0,
+            'errors': 0,
+            'status_seconds': 0.0,
+            'delay': 0.0,
+        }
+
+    def _get_status_json(self, timeout=None):
+        return json.loads(self._run_command_output(['smbstatus', '-j'], timeout=timeout))
 
     def _log_event(self, event_type, details):
         timestamp = f"[ {datetime.now().strftime('%d.%m.%Y %H:%M:%S')} ]"
         print(timestamp, details)
 
-    def _track_objects(self, current_objects, stored_objects, object_type):
-        # Handle new objects
-        for obj_id, obj_data in current_objects.items():
-            if obj_id not in stored_objects:
-                stored_objects[obj_id] = obj_data
-                self._log_event(
-                    f"new_{object_type}",
-                    self._get_object_message(object_type, 'opened', obj_id, obj_data)
-                )
+    def _count(self, stats, key, object_type, delta):
+        if not key:
+            return
+        counters = stats.setdefault(key, {'sessions': 0, 'tcons': 0, 'open_files': 0})
+        counters[object_type] += delta
+        if not any(counters.values()):
+            del stats[key]
+
+    def _update_counters(self, object_type, record, delta):
+        if object_type == 'tcons':
+            self._count(self.share_stats, record.service, object_type, delta)
+        elif object_type == 'open_files':
+            self._count(self.share_stats, record.share, object_type, delta)
+        self._count(self.user_stats, record.username, object_type, delta)
+
+    def _session_username(self, session_id):
+        session = self.sessions.get(session_id)
+        return session.username if session is not None else ""
+
+    def _uid_username(self, opens, uid_users):
+        for open_data in opens.values():
+            username = uid_users.get(open_data.get('uid'))
+            if username:
+                return username
+        return ""
 
-        # Handle closed objects
-        closed_objects = set(stored_objects) - set(current_objects)
-        for obj_id in closed_objects:
-            obj_data = stored_objects.pop(obj_id)
+    def _track_objects(self, current_objects, tracker, factory):
+        """Возвращает количество открытых и закрытых объектов"""
+        opened, closed = tracker.update(current_objects, factory)
+
+        for obj_id, record in opened:
+            self._update_counters(tracker.object_type, record, 1)
             self._log_event(
-                f"closed_{object_type}",
-                self._get_object_message(object_type, 'closed', obj_id, obj_data)
+                f"new_{tracker.object_type}",
+                self._get_object_message(tracker.object_type, 'opened', obj_id, record)
             )
 
-    def _get_object_message(self, object_type, action, obj_id, obj_data):
+        for obj_id, record in closed:
+            self._update_counters(tracker.object_type, record, -1)
+            self._log_event(
+                f"closed_{tracker.object_type}",
+                self._get_object_message(tracker.object_type, 'closed', obj_id, record)
+            )
+
+        if tracker.dropped != self._reported_drops.get(tracker.object_type, 0):
+            self._reported_drops[tracker.object_type] = tracker.dropped
+            if tracker.dropped:
+                self._log_event(
+                    'tracking_cap',
+                    f"Tracking limit reached: {tracker.dropped} {tracker.object_type} are not tracked (limit {tracker.max_objects})"
+                )
+
+        return len(opened) + len(closed)
+
+    def _get_object_message(self, object_type, action, obj_id, record):
         if object_type == 'tcons':
             return {
-                'opened': f"Opened new connection: {obj_data['machine']} ({obj_id}) to '{obj_data['service']}'",
-                'closed': f"Disconnected: {obj_data['machine']} ({obj_id}) authorized as '{obj_data['service']}'"
+                'opened': f"Opened new connection: {record.machine} ({obj_id}) to '{record.service}'",
+                'closed': f"Disconnected: {record.machine} ({obj_id}) authorized as '{record.service}'"
             }[action]
         elif object_type == 'sessions':
             return {
-                'opened': f"Created new session: {obj_data['remote_machine']} ({obj_id}) authorized as '{obj_data['username']}'",
-                'closed': f"Removed session: {obj_data['remote_machine']} ({obj_id}) authorized as '{obj_data['username']}'"
+                'opened': f"Created new session: {record.remote_machine} ({obj_id}) authorized as '{record.username}'",
+                'closed': f"Removed session: {record.remote_machine} ({obj_id}) authorized as '{record.username}'"
             }[action]
         elif object_type == 'open_files':
             return {
-                'opened': f"Open file '{obj_data['filename']}' in '{obj_data['service_path'].split('/')[-1]}'",
-                'closed': f"Close file '{obj_data['filename']}' in '{obj_data['service_path'].split('/')[-1]}'"
+                'opened': f"Open file '{record.filename}' in '{record.share}'",
+                'closed': f"Close file '{record.filename}' in '{record.share}'"
             }[action]
         return ""
 
-    def monitor(self, delay=2):
-        while True:
-            try:
-                data = self._get_status_json()
+    def _poll(self, timeout):
+        """Один опрос smbstatus. Возвращает количество изменений"""
+        started = time.monotonic()
+        try:
+            data = self._get_status_json(timeout=timeout)
+        finally:
+            self._count_poll(started)
+        return self._apply_status(data)
+
+    async def _poll_async(self, shell, timeout):
+        """Опрос smbstatus через AsyncShell"""
+        started = time.monotonic()
+        try:
+            data = json.loads(await shell._run_command_output(['smbstatus', '-j'], timeout=timeout))
+        finally:
+            self._count_poll(started)
+        return self._apply_status(data)
+
+    def _count_poll(self, started):
+        self.monitor_stats['polls'] += 1
+        self.monitor_stats['status_seconds'] += time.monotonic() - started
+
+    def _apply_status(self, data):
+        # Сессии отслеживаются первыми: по ним определяются пользователи подключений и файлов
+        changes = self._track_objects(data.get('sessions', {}), self.sessions, Session)
+        changes += self._track_objects(
+            data.get('tcons', {}), self.tcons,
+            lambda obj_data: Tcon(obj_data, self._session_username(obj_data.get('session_id')))
+        )
+        uid_users = {session.uid: session.username for session in self.sessions.objects.values()}
+        changes += self._track_objects(
+            data.get('open_files', {}), self.open_files,
+            lambda obj_data: OpenFile(obj_data, self._uid_username(obj_data.get('opens', {}), uid_users))
+        )
+        return changes
+
+    def _next_delay(self, delay, changes, min_delay, max_delay):
+        """Быстрый опрос при изменениях, постепенное замедление в простое"""
+        if changes:
+            return min_delay
+        # При активных сессиях замедляемся меньше, чем при полном простое
+        limit = max_delay if not len(self.sessions) else max(min_delay, max_delay / 4)
+        return min(delay * 2, limit)
+
+    def _report_monitor_stats(self, period, previous):
+        """Отчет о частоте опроса и времени работы smbstatus за период"""
+        stats = self.monitor_stats
+        polls = stats['polls'] - previous['polls']
+        status_seconds = stats['status_seconds'] - previous['status_seconds']
+        if polls:
+            self._log_event(
+                'monitor_stats',
+                f"Monitor: {polls / period * 60:.1f} polls/min, smbstatus {status_seconds / polls * 1000:.0f} ms avg "
+                f"({status_seconds / period * 100:.2f}% of time), current interval {stats['delay']:.1f}s"
+            )
+
+    def _monitor_state(self, min_delay):
+        return {
+            'delay': min_delay,
+            'failures': 0,
+            'last_error': None,
+            'last_report': time.monotonic(),
+            'reported': dict(self.monitor_stats),
+        }
 
-                self._track_objects(data.get('tcons', {}), self.tcons, 'tcons')
-                self._track_objects(data.get('sessions', {}), self.sessions, 'sessions')
-                self._track_objects(data.get('open_files', {}), self.open_files, 'open_files')
+    def _monitor_step(self, state, changes, error, min_delay, max_delay, report_interval):
+        """Обработка результата опроса. Возвращает задержку до следующего"""
+        if error is None:
+            if state['failures']:
+                self._log_event('recovered', f"Monitoring recovered after {state['failures']} failed attempts")
+                state['failures'] = 0
+                state['last_error'] = None
+                state['delay'] = min_delay
 
+            state['delay'] = self._next_delay(state['delay'], changes, min_delay, max_delay)
+        else:
+            state['failures'] += 1
+            self.monitor_stats['errors'] += 1
+            # Повторяющиеся ошибки не дублируются в логе
+            if str(error) != state['last_error']:
+                state['last_error'] = str(error)
+                self._log_event('error', f"Error in monitoring: {state['last_error']}")
+            state['delay'] = min(state['delay'] * 2, max_delay)
+
+        self.monitor_stats['delay'] = state['delay']
+
+        now = time.monotonic()
+        if report_interval and now - state['last_report'] >= report_interval:
+            self._report_monitor_stats(now - state['last_report'], state['reported'])
+            state['reported'] = dict(self.monitor_stats)
+            state['last_report'] = now
+
+        return state['delay']
+
+    def monitor(self, min_delay=1, max_delay=30, timeout=10, report_interval=600):
+        state = self._monitor_state(min_delay)
+        while True:
+            changes, error = 0, None
+            try:
+                changes = self._poll(timeout)
             except Exception as e:
-                self._log_event('error', f"Error in monitoring: {str(e)}")
+                error = e
+            time.sleep(self._monitor_step(state, changes, error, min_delay, max_delay, report_interval))
 
-            time.sleep(delay)
+    async def monitor_async(self, shell, min_delay=1, max_delay=30, timeout=10, report_interval=600):
+        """monitor() для цикла событий: smbstatus запускается через AsyncShell"""
+        state = self._monitor_state(min_delay)
+        while True:
+            changes, error = 0, None
+            try:
+                changes = await self._poll_async(shell, timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+            await asyncio.sleep(self._monitor_step(state, changes, error, min_delay, max_delay, report_interval))
@@ -0,0 +1,59 @@
+import time
+import struct
+import hashlib
+
+def _rotl(value, shift):
+    value &= 0xFFFFFFFF
+    return ((value << shift) | (value >> (32 - shift))) & 0xFFFFFFFF
+
+def md4(data):
+    """MD4 (RFC 1320) на чистом Python - в OpenSSL 3 он часто отключен"""
+    message = bytearray(data)
+    length = len(message) * 8
+    message.append(0x80)
+    while len(message) % 64 != 56:
+        message.append(0)
+    message += struct.pack("<Q", length & 0xFFFFFFFFFFFFFFFF)
+
+    a, b, c, d = 0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476
+    for offset in range(0, len(message), 64):
+        x = struct.unpack("<16I", message[offset:offset + 64])
+        aa, bb, cc, dd = a, b, c, d
+
+        f = lambda x1, y, z: (x1 & y) | (~x1 & z)
+        for i in (0, 4, 8, 12):
+            a = _rotl(a + f(b, c, d) + x[i], 3)
+            d = _rotl(d + f(a, b, c) + x[i + 1], 7)
+            c = _rotl(c + f(d, a, b) + x[i + 2], 11)
+            b = _rotl(b + f(c, d, a) + x[i + 3], 19)
+
+        g = lambda x1, y, z: (x1 & y) | (x1 & z) | (y & z)
+        for i in (0, 1, 2, 3):
+            a = _rotl(a + g(b, c, d) + x[i] + 0x5A827999, 3)
+            d = _rotl(d + g(a, b, c) + x[i + 4] + 0x5A827999, 5)
+            c = _rotl(c + g(d, a, b) + x[i + 8] + 0x5A827999, 9)
+            b = _rotl(b + g(c, d, a) + x[i + 12] + 0x5A827999, 13)
+
+        h = lambda x1, y, z: x1 ^ y ^ z
+        for i in (0, 2, 1, 3):
+            a = _rotl(a + h(b, c, d) + x[i] + 0x6ED9EBA1, 3)
+            d = _rotl(d + h(a, b, c) + x[i + 8] + 0x6ED9EBA1, 9)
+            c = _rotl(c + h(d, a, b) + x[i + 4] + 0x6ED9EBA1, 11)
+            b = _rotl(b + h(c, d, a) + x[i + 12] + 0x6ED9EBA1, 15)
+
+        a, b, c, d = (a + aa) & 0xFFFFFFFF, (b + bb) & 0xFFFFFFFF, (c + cc) & 0xFFFFFFFF, (d + dd) & 0xFFFFFFFF
+
+    return struct.pack("<4I", a, b, c, d)
+
+def nt_hash(password):
+    """NT-хэш пароля (MD4 от UTF-16LE) в виде hex-строки"""
+    data = password.encode("utf-16-le")
+    try:
+        digest = hashlib.new("md4", data).digest()
+    except ValueError:
+        digest = md4(data)
+    return digest.hex().upper()
+
+def smbpasswd_line(username, uid, password):
+    """Строка файла формата smbpasswd для импорта через pdbedit"""
+    return f"{username}:{uid}:{'X' * 32}:{nt_hash(password)}:[U          ]:LCT-{int(time.time()):08X}:"
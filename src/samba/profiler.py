@@ -0,0 +1,102 @@
+import re
+import time
+import threading
+import subprocess
+from collections import deque
+from shell import Shell
+
+class ProfileSample:
+    """Скорости за интервал между двумя чтениями счетчиков профилирования smbd"""
+    __slots__ = ("timestamp", "interval", "read_bytes_per_sec", "write_bytes_per_sec", "ops_per_sec", "shares", "users")
+
+    def __init__(self, timestamp, interval, read_bytes_per_sec, write_bytes_per_sec, ops_per_sec, shares, users):
+        self.timestamp = timestamp
+        self.interval = interval
+        self.read_bytes_per_sec = read_bytes_per_sec
+        self.write_bytes_per_sec = write_bytes_per_sec
+        self.ops_per_sec = ops_per_sec
+        self.shares = shares
+        self.users = users
+
+class SambaProfiler(Shell):
+    profile_line = re.compile(r'^\s*(\w+):\s+(\d+)\s*$')
+
+    def _init_profiling(self, profiling=False, history=360):
+        self.profiling = profiling
+        self.profile_history = deque(maxlen=history)
+        self._profile_counters = None
+        self._profile_thread = None
+        self._profile_stop = threading.Event()
+
+    def _get_profile(self, timeout=None):
+        """Чтение счетчиков `smbstatus --profile`"""
+        counters = {}
+        output = self._run_command_output(['smbstatus', '--profile'], timeout=timeout)
+        for line in output.splitlines():
+            match = self.profile_line.match(line)
+            if match:
+                counters[match.group(1)] = int(match.group(2))
+        return counters
+
+    def enable_profiling(self):
+        """Включение профилирования в работающем smbd (без перезапуска)"""
+        try:
+            self._run_command(["smbcontrol", "smbd", "profile", "on"])
+        except subprocess.CalledProcessError as e:
+            self._print(f"Failed to enable smbd profiling: {e}")
+
+    def sample_profile(self, timeout=None):
+        """Добавляет в историю скорости с момента прошлого вызова. Возвращает ProfileSample или None"""
+        now = time.monotonic()
+        counters = self._get_profile(timeout=timeout)
+        previous = self._profile_counters
+        self._profile_counters = (now, counters)
+        if previous is None:
+            return None
+
+        previous_time, previous_counters = previous
+        interval = now - previous_time
+        deltas = {name: value - previous_counters.get(name, 0) for name, value in counters.items()}
+        # Отрицательная разница - счетчики сброшены (перезапуск smbd)
+        if interval <= 0 or any(delta < 0 for delta in deltas.values()):
+            return None
+
+        ops_per_sec = {
+            name[len('smb2_'):-len('_count')]: delta / interval
+            for name, delta in deltas.items()
+            if name.startswith('smb2_') and name.endswith('_count') and delta
+        }
+        sample = ProfileSample(
+            timestamp               = time.time(),
+            interval                = interval,
+            read_bytes_per_sec      = deltas.get('smb2_read_outbytes', 0) / interval,
+            write_bytes_per_sec     = deltas.get('smb2_write_inbytes', 0) / interval,
+            ops_per_sec             = ops_per_sec,
+            # Счетчики профилирования общие для smbd, поэтому к скоростям прикладывается
+            # картина активных шар и пользователей из трекера сессий
+            shares                  = {share: counters['tcons'] for share, counters in dict(self.share_stats).items() if counters['tcons']},
+            users                   = {user: counters['sessions'] for user, counters in dict(self.user_stats).items() if counters['sessions']}
+        )
+        self.profile_history.append(sample)
+        return sample
+
+    def _profile_loop(self, interval, timeout):
+        while not self._profile_stop.is_set():
+            try:
+                self.sample_profile(timeout=timeout)
+            except Exception as e:
+                self._print(f"Failed to sample smbd profile: {e}")
+            self._profile_stop.wait(interval)
+
+    def start_profile_sampler(self, interval=10, timeout=10):
+        if not self.profiling or self._profile_thread is not None:
+            return
+        self.enable_profiling()
+        self._profile_thread = threading.Thread(target=self._profile_loop, args=(interval, timeout), name="profile-sampler", daemon=True)
+        self._profile_thread.start()
+
+    def stop_profile_sampler(self):
+        self._profile_stop.set()
+        if self._profile_thread is not None:
+            self._profile_thread.join()
+            self._profile_thread = None
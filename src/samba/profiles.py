@@ -0,0 +1,119 @@
+import glob
+import ctypes
+import errno
+
+# Профиль производительности: параметры секции [global] (применяются только
+# у глобального профиля) и параметры шары
+PROFILES = {
+    "default": {
+        "global": {
+            "socket options": "TCP_NODELAY IPTOS_LOWDELAY SO_RCVBUF=65536 SO_SNDBUF=65536",
+            "min receivefile size": 16384,
+            "aio read size": 16384,
+            "aio write size": 16384,
+            "smb2 max read": 8388608,
+            "smb2 max write": 8388608,
+            "smb2 max trans": 8388608,
+            "use sendfile": True,
+            "strict locking": False,
+            "read raw": True,
+            "write raw": True,
+        },
+        "share": {},
+    },
+    # Большие файлы, потоковое чтение и запись (медиа, бэкапы)
+    "sequential": {
+        "global": {
+            "socket options": "TCP_NODELAY IPTOS_THROUGHPUT SO_RCVBUF=524288 SO_SNDBUF=524288",
+            "min receivefile size": 16384,
+            "smb2 max read": 8388608,
+            "smb2 max write": 8388608,
+            "smb2 max trans": 8388608,
+        },
+        "share": {
+            "aio read size": 1,
+            "aio write size": 1,
+            "use sendfile": True,
+            "strict locking": False,
+            "oplocks": True,
+            "level2 oplocks": True,
+            "io_uring": True,
+        },
+    },
+    # Много мелких файлов и операций с метаданными (исходный код)
+    "small_files": {
+        "global": {
+            "socket options": "TCP_NODELAY IPTOS_LOWDELAY",
+            "getwd cache": True,
+            "smb2 leases": True,
+        },
+        "share": {
+            # Мелкие запросы быстрее выполнить синхронно, чем передавать в пул потоков
+            "aio read size": 0,
+            "aio write size": 0,
+            "strict locking": False,
+            "posix locking": False,
+            "oplocks": True,
+            "level2 oplocks": True,
+        },
+    },
+    # Много клиентов, работающих с общими файлами
+    "many_clients": {
+        "global": {
+            "socket options": "TCP_NODELAY IPTOS_LOWDELAY",
+        },
+        "share": {
+            "aio read size": 1,
+            "aio write size": 1,
+            "strict locking": False,
+            # Без кэширования на клиентах: oplocks = no отключает и oplock, и lease,
+            # поэтому нет лавины их отзывов при одновременном доступе
+            "oplocks": False,
+            "io_uring": True,
+        },
+    },
+}
+
+VFS_MODULE_PATTERNS = ("/usr/lib*/samba/vfs/{}.so", "/usr/lib*/*/samba/vfs/{}.so")
+_vfs_modules = {}
+
+def vfs_module_available(name):
+    """Есть ли у установленной Samba VFS-модуль (проверяется один раз)"""
+    if name not in _vfs_modules:
+        _vfs_modules[name] = any(glob.glob(pattern.format(name)) for pattern in VFS_MODULE_PATTERNS)
+    return _vfs_modules[name]
+
+IO_URING_SETUP = 425
+
+def _probe_io_uring():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        # С нулевым указателем на параметры доступный вызов завершается с EFAULT
+        libc.syscall(IO_URING_SETUP, 1, None)
+    except (OSError, AttributeError):
+        return False
+    return ctypes.get_errno() not in (errno.ENOSYS, errno.EPERM)
+
+def io_uring_supported():
+    """Доступен ли io_uring: VFS-модуль Samba и системный вызов (может быть
+    отключен в ядре или запрещен seccomp-профилем контейнера)"""
+    if "io_uring_syscall" not in _vfs_modules:
+        _vfs_modules["io_uring_syscall"] = _probe_io_uring()
+    return vfs_module_available("io_uring") and _vfs_modules["io_uring_syscall"]
+
+def global_settings(profile):
+    """Параметры [global]: профиль поверх параметров по умолчанию"""
+    return {**PROFILES["default"]["global"], **PROFILES[profile]["global"]}
+
+def share_settings(profile):
+    """Параметры шары в формате smb.conf"""
+    settings = {}
+    for key, value in PROFILES[profile]["share"].items():
+        if key == "io_uring":
+            if value and io_uring_supported():
+                settings["vfs objects"] = "io_uring"
+            continue
+        if isinstance(value, bool):
+            value = "yes" if value else "no"
+        settings[key] = str(value)
+    return settings
@@ -0,0 +1,130 @@
+import time
+import socket
+import signal
+import threading
+import subprocess
+from shell import Shell
+
+class SambaSupervisor(Shell):
+    """Запуск smbd дочерним процессом (smbd --foreground) без systemctl.
+
+    После запуска ожидается, пока порт 445 начнет принимать соединения.
+    Упавший smbd перезапускается с нарастающей задержкой.
+    """
+    SMBD_PORT = 445
+    # Процесс, проработавший дольше, считается стабильным - задержка сбрасывается
+    STABLE_SECONDS = 60
+
+    def _init_supervisor(self, supervise=False, ready_timeout=30, max_backoff=60):
+        self.supervise = supervise
+        # Вызывается с pid каждого запущенного smbd (например, перенос в cgroup)
+        self.on_smbd_start = None
+        self.smbd_ready_timeout = ready_timeout
+        self.smbd_max_backoff = max_backoff
+        self.smbd_restarts = 0
+        self._smbd = None
+        self._smbd_lock = threading.Lock()
+        self._supervisor_thread = None
+        self._supervisor_stop = threading.Event()
+
+    def _spawn_smbd(self):
+        output = None if self.debug else subprocess.DEVNULL
+        self._smbd = subprocess.Popen(
+            ["smbd", "--foreground", "--no-process-group"],
+            stdout=output,
+            stderr=output
+        )
+        if self.on_smbd_start is not None:
+            self.on_smbd_start(self._smbd.pid)
+        return self._smbd
+
+    def wait_smbd_ready(self, timeout=None):
+        """Ожидание приема соединений на порту 445. Возвращает время ожидания или None"""
+        timeout = self.smbd_ready_timeout if timeout is None else timeout
+        started = time.monotonic()
+        while time.monotonic() - started < timeout:
+            proc = self._smbd
+            # Остановка (stop_smbd) прерывает ожидание
+            if proc is None or proc.poll() is not None or self._supervisor_stop.is_set():
+                return None
+            try:
+                with socket.create_connection(("127.0.0.1", self.SMBD_PORT), timeout=0.5):
+                    return time.monotonic() - started
+            except OSError:
+                time.sleep(0.05)
+        return None
+
+    def _supervise(self):
+        failures = 0
+        while True:
+            with self._smbd_lock:
+                # stop_smbd() мог обнулить процесс после проверки флага
+                proc = self._smbd
+                if proc is None or self._supervisor_stop.is_set():
+                    return
+            started = time.monotonic()
+            returncode = proc.wait()
+            if self._supervisor_stop.is_set():
+                return
+
+            failures = 1 if time.monotonic() - started >= self.STABLE_SECONDS else failures + 1
+            delay = min(2 ** (failures - 1), self.smbd_max_backoff)
+            self._log_event('smbd_exit', f"smbd exited with code {returncode}. Restarting in {delay}s")
+            if self._supervisor_stop.wait(delay):
+                return
+
+            with self._smbd_lock:
+                if self._supervisor_stop.is_set():
+                    return
+                self._spawn_smbd()
+                self.smbd_restarts += 1
+
+            ready = self.wait_smbd_ready()
+            if ready is not None:
+                self._log_event('smbd_ready', f"smbd restarted, ready in {ready:.2f}s")
+
+    def start_smbd(self):
+        """Запуск smbd под наблюдением. Возвращает время до готовности или None"""
+        with self._smbd_lock:
+            if self._smbd is not None and self._smbd.poll() is None:
+                return 0.0
+            self._supervisor_stop.clear()
+            self._spawn_smbd()
+
+        ready = self.wait_smbd_ready()
+        if ready is None and not self._supervisor_stop.is_set():
+            print(f"smbd is not accepting connections on port {self.SMBD_PORT} after {self.smbd_ready_timeout}s")
+        elif ready is not None:
+            print(f"smbd is ready in {ready:.2f}s")
+
+        if self._supervisor_thread is None or not self._supervisor_thread.is_alive():
+            self._supervisor_thread = threading.Thread(target=self._supervise, name="smbd-supervisor", daemon=True)
+            self._supervisor_thread.start()
+        return ready
+
+    def stop_smbd(self, timeout=10):
+        """Остановка smbd: SIGTERM, затем SIGKILL по истечении timeout.
+        Вся остановка, включая ожидание потока наблюдения, укладывается в timeout"""
+        started = time.monotonic()
+        with self._smbd_lock:
+            self._supervisor_stop.set()
+            proc = self._smbd
+            self._smbd = None
+
+        if proc is not None and proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+        if self._supervisor_thread is not None:
+            self._supervisor_thread.join(max(0.0, timeout - (time.monotonic() - started)))
+            if not self._supervisor_thread.is_alive():
+                self._supervisor_thread = None
+
+    def smbd_supervised(self):
+        """smbd запущен этим процессом и работает"""
+        proc = self._smbd
+        return proc is not None and proc.poll() is None
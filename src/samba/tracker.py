@@ -0,0 +1,86 @@
+
+class TrackedObject:
+    """Компактная запись объекта smbstatus - хранятся только нужные поля"""
+    __slots__ = ("generation",)
+
+class Session(TrackedObject):
+    __slots__ = ("remote_machine", "username", "uid")
+
+    def __init__(self, data):
+        self.remote_machine = data.get("remote_machine", "")
+        self.username = data.get("username", "")
+        self.uid = data.get("uid")
+
+class Tcon(TrackedObject):
+    __slots__ = ("machine", "service", "username")
+
+    def __init__(self, data, username=""):
+        self.machine = data.get("machine", "")
+        self.service = data.get("service", "")
+        self.username = username
+
+class OpenFile(TrackedObject):
+    __slots__ = ("filename", "share", "username")
+
+    def __init__(self, data, username=""):
+        self.filename = data.get("filename", "")
+        self.share = data.get("service_path", "").rstrip("/").split("/")[-1]
+        self.username = username
+
+class ObjectTracker:
+    """Инкрементальное отслеживание объектов с ограничением по количеству.
+
+    Вместо построения множеств ключей на каждом опросе у записи хранится
+    номер опроса, в котором она была видна в последний раз.
+    """
+    def __init__(self, object_type, max_objects=10000):
+        self.object_type = object_type
+        self.max_objects = max_objects
+        self.objects = {}
+        self.generation = 0
+        self.dropped = 0
+
+    def update(self, current, factory):
+        """Возвращает списки (открытые, закрытые) пар (id, запись)"""
+        self.generation += 1
+        generation = self.generation
+        new = []
+        seen = 0
+
+        for obj_id, obj_data in current.items():
+            record = self.objects.get(obj_id)
+            if record is not None:
+                record.generation = generation
+                seen += 1
+            else:
+                new.append((obj_id, obj_data))
+
+        closed = []
+        # Если все ранее известные объекты на месте, просматривать их не нужно.
+        # Закрытые удаляются до добавления новых, чтобы освобожденные места были доступны
+        if seen != len(self.objects):
+            for obj_id, record in self.objects.items():
+                if record.generation != generation:
+                    closed.append((obj_id, record))
+            for obj_id, _ in closed:
+                del self.objects[obj_id]
+
+        opened = []
+        free = max(0, self.max_objects - len(self.objects))
+        for obj_id, obj_data in new[:free]:
+            record = factory(obj_data)
+            record.generation = generation
+            self.objects[obj_id] = record
+            opened.append((obj_id, record))
+        self.dropped = len(new) - len(opened)
+
+        return opened, closed
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, obj_id):
+        return obj_id in self.objects
+
+    def get(self, obj_id, default=None):
+        return self.objects.get(obj_id, default)
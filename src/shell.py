@@ -1,6 +1,45 @@
+import os
+import time
+import asyncio
+import threading
 import subprocess
+from contextlib import contextmanager
+
+class CommandStats:
+    """Гистограмма длительностей и кодов завершения одной команды"""
+    BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+    __slots__ = ("count", "total", "max", "failures", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.failures = 0
+        self.buckets = [0] * (len(self.BUCKETS) + 1)
+
+    def observe(self, duration, returncode):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if returncode != 0:
+            self.failures += 1
+        for index, bound in enumerate(self.BUCKETS):
+            if duration <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
 
 class Shell:
+    # Общие для всех модулей хуки профилирования и статистика команд
+    hooks = []
+    command_stats = {}
+    _stats_lock = threading.Lock()
+
+    # Тяжелые по вводу-выводу команды выполняются не более heavy_limit одновременно
+    HEAVY_COMMANDS = ("dd", "mkfs", "e2fsck", "fsck", "resize2fs", "fallocate", "fstrim", "cp")
+    heavy_limit = threading.BoundedSemaphore(2)
+
     def __init__(self, debug=False):
         self.debug = debug
         self.moduleName = ""
@@ -8,7 +47,70 @@ class Shell:
     def _print(self, text):
         print(f"[ {self.moduleName} ]" if len(self.moduleName) > 0 else "", text)
 
-    def _run_command(self, command, input_text=None, check=True):
+    @classmethod
+    def add_hook(cls, hook):
+        """Хук вызывается после каждой команды: hook(name, command, duration, returncode)"""
+        cls.hooks.append(hook)
+
+    @classmethod
+    def remove_hook(cls, hook):
+        if hook in cls.hooks:
+            cls.hooks.remove(hook)
+
+    @classmethod
+    def set_heavy_limit(cls, limit):
+        cls.heavy_limit = threading.BoundedSemaphore(max(1, limit))
+
+    @classmethod
+    def _is_heavy(cls, command):
+        name = os.path.basename(command[0]) if command else ""
+        # reflink-копия не копирует данные
+        if name == "cp" and "--reflink=always" in command:
+            return False
+        return name.split(".")[0] in cls.HEAVY_COMMANDS
+
+    @contextmanager
+    def _heavy_slot(self, command):
+        if not self._is_heavy(command):
+            yield
+            return
+        limit = Shell.heavy_limit
+        with limit:
+            yield
+
+    def _record(self, command, started, returncode):
+        """returncode равен None, если команда не завершилась (таймаут, не найдена)"""
+        duration = time.monotonic() - started
+        name = os.path.basename(command[0]) if command else ""
+
+        with Shell._stats_lock:
+            stats = Shell.command_stats.get(name)
+            if stats is None:
+                stats = Shell.command_stats[name] = CommandStats()
+            stats.observe(duration, returncode)
+
+        for hook in list(Shell.hooks):
+            try:
+                hook(name, command, duration, returncode)
+            except Exception as e:
+                self._print(f"Command hook failed: {e}")
+
+    @classmethod
+    def command_report(cls, limit=10):
+        """Самые долгие команды по суммарному времени"""
+        with cls._stats_lock:
+            stats = sorted(cls.command_stats.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+
+        lines = ["Slowest commands:"]
+        for name, command_stats in stats:
+            lines.append(
+                f"  • {name:<12} {command_stats.count:5} calls  total {command_stats.total:8.2f}s  "
+                f"avg {command_stats.total / command_stats.count:7.3f}s  max {command_stats.max:7.3f}s  "
+                f"failed {command_stats.failures}"
+            )
+        return "\n".join(lines)
+
+    def _run_command(self, command, input_text=None, check=True, timeout=None):
         """Выполнение команд с обработкой ввода"""
         args = {
             "args": command,
@@ -17,33 +119,147 @@ class Shell:
             "shell": False
         }
 
-        if input_text:
-            proc = subprocess.Popen(**args, stdin=subprocess.PIPE, text=True)
-            proc.communicate(input_text)
-        else:
-            subprocess.run(**args, check=check)
+        with self._heavy_slot(command):
+            started = time.monotonic()
+            returncode = None
+            try:
+                if input_text:
+                    proc = subprocess.Popen(**args, stdin=subprocess.PIPE, text=True)
+                    try:
+                        proc.communicate(input_text, timeout=timeout)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+                        proc.communicate()
+                        raise
+                    returncode = proc.returncode
+                    if check and returncode != 0:
+                        raise subprocess.CalledProcessError(returncode, command)
+                else:
+                    returncode = subprocess.run(**args, check=check, timeout=timeout).returncode
+            except subprocess.CalledProcessError as e:
+                returncode = e.returncode
+                raise
+            finally:
+                self._record(command, started, returncode)
 
-    def _run_command_grep(self, command, grep_pattern):
+    def _run_command_grep(self, command, grep_pattern, timeout=None):
         """Выполнение команд с фильтрацией"""
         full_cmd = f"{' '.join(command)} | grep {grep_pattern}"
-        result = subprocess.run(
-            full_cmd,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        started = time.monotonic()
+        returncode = None
+        try:
+            result = subprocess.run(
+                full_cmd,
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=timeout
+            )
+            returncode = result.returncode
+        finally:
+            self._record(command, started, returncode)
+
         if self.debug:
             print(result.stdout)
         return result.stdout
 
-    def _run_command_output(self, command):
+    def _run_command_output(self, command, timeout=None):
         """Выполнение команд с выводом"""
         args = {
             "args": command,
             # "stdout": subprocess.PIPE,
             "stderr": None if self.debug else subprocess.DEVNULL,
-            "shell": False
+            "shell": False,
+            "timeout": timeout
         }
 
-        return subprocess.check_output(**args).decode()
+        with self._heavy_slot(command):
+            started = time.monotonic()
+            returncode = None
+            try:
+                output = subprocess.check_output(**args).decode()
+                returncode = 0
+                return output
+            except subprocess.CalledProcessError as e:
+                returncode = e.returncode
+                raise
+            finally:
+                self._record(command, started, returncode)
+
+class AsyncShell(Shell):
+    """Асинхронный вариант Shell: те же методы, но корутины на asyncio.create_subprocess_exec.
+
+    Лимит тяжелых команд общий с синхронным Shell. При отмене или таймауте
+    запущенный процесс завершается.
+    """
+    async def _heavy_acquire(self, command):
+        if not self._is_heavy(command):
+            return None
+        limit = Shell.heavy_limit
+        # Семафор общий с синхронными потоками - ждем его в пуле потоков
+        acquire = asyncio.ensure_future(asyncio.to_thread(limit.acquire))
+        try:
+            await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # Захват в потоке завершится и после отмены - слот сразу возвращается
+            acquire.add_done_callback(lambda _: limit.release())
+            raise
+        return limit
+
+    async def _communicate(self, proc, command, input_data, timeout):
+        try:
+            return await asyncio.wait_for(proc.communicate(input_data), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            if isinstance(e, asyncio.TimeoutError):
+                raise subprocess.TimeoutExpired(command, timeout)
+            raise
+
+    async def _exec(self, command, input_text=None, capture=False, timeout=None, shell_command=None):
+        """Запуск command или, если задана, строки shell_command через оболочку.
+        command используется и для статистики команд"""
+        limit = await self._heavy_acquire(command)
+        started = time.monotonic()
+        returncode = None
+        try:
+            streams = {
+                "stdin": subprocess.PIPE if input_text else subprocess.DEVNULL,
+                "stdout": subprocess.PIPE if capture else (None if self.debug else subprocess.DEVNULL),
+                "stderr": None if self.debug else subprocess.DEVNULL,
+            }
+            if shell_command is not None:
+                proc = await asyncio.create_subprocess_shell(shell_command, **streams)
+            else:
+                proc = await asyncio.create_subprocess_exec(*command, **streams)
+
+            output, _ = await self._communicate(proc, command, input_text.encode() if input_text else None, timeout)
+            returncode = proc.returncode
+            return returncode, (output or b"").decode()
+        finally:
+            if limit is not None:
+                limit.release()
+            self._record(command, started, returncode)
+
+    async def _run_command(self, command, input_text=None, check=True, timeout=None):
+        """Выполнение команд с обработкой ввода"""
+        returncode, _ = await self._exec(command, input_text=input_text, timeout=timeout)
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    async def _run_command_grep(self, command, grep_pattern, timeout=None):
+        """Выполнение команд с фильтрацией"""
+        full_cmd = f"{' '.join(command)} | grep {grep_pattern}"
+        _, output = await self._exec(command, capture=True, timeout=timeout, shell_command=full_cmd)
+        if self.debug:
+            print(output)
+        return output
+
+    async def _run_command_output(self, command, timeout=None):
+        """Выполнение команд с выводом"""
+        returncode, output = await self._exec(command, capture=True, timeout=timeout)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, output)
+        return output
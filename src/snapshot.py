@@ -0,0 +1,30 @@
+import os
+import sys
+
+import config
+from provision import Provisioner
+from VirtualDisk import VirtualDisk, VirtualDiskError
+
+# Снимок образа шары в работающем контейнере:
+#   docker exec <контейнер> python3 src/snapshot.py <шара> [путь к снимку]
+
+DISKS_PATH = os.path.abspath("./virtual_drives")
+DISKS_MOUNT_PATH = os.path.abspath("/mnt/virtual/")
+
+def snapshot_share(key, target=None):
+    """Снимок образа шары из конфига. Возвращает путь к снимку"""
+    if key not in config.SHARE:
+        raise VirtualDiskError(f"Share '{key}' is not configured")
+    image = Provisioner(DISKS_PATH, DISKS_MOUNT_PATH).image_path(key, config.SHARE[key])
+    return VirtualDisk(image).snapshot(os.path.abspath(target) if target else None)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 src/snapshot.py <share> [target]")
+        sys.exit(2)
+
+    try:
+        print(f"Snapshot of '{sys.argv[1]}' created: {snapshot_share(*sys.argv[1:])}")
+    except VirtualDiskError as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,64 @@
+import os
+import json
+import hashlib
+import hmac
+import threading
+
+class StateStore:
+    """Состояние, примененное при последнем запуске (пользователи, шары, loop/mount)"""
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.state = self.load()
+
+    @staticmethod
+    def empty():
+        return {"users": {}, "shares": {}}
+
+    def load(self):
+        """Загрузка состояния. Поврежденный или отсутствующий файл означает пустое состояние"""
+        try:
+            with open(self.filename) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return self.empty()
+
+        if not isinstance(state, dict):
+            return self.empty()
+        for section, value in self.empty().items():
+            if not isinstance(state.get(section), dict):
+                state[section] = value
+        return state
+
+    def save(self):
+        """Атомарная запись состояния"""
+        with self._lock:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            tmp_filename = f"{self.filename}.tmp"
+            with open(tmp_filename, "w") as f:
+                json.dump(self.state, f, indent=2, sort_keys=True)
+            os.replace(tmp_filename, self.filename)
+
+    @property
+    def users(self):
+        return self.state["users"]
+
+    @property
+    def shares(self):
+        return self.state["shares"]
+
+    @staticmethod
+    def hash_secret(secret, salt=None):
+        """Соленый хэш пароля для обнаружения изменений без хранения самого пароля"""
+        salt = bytes.fromhex(salt) if salt else os.urandom(16)
+        digest = hmac.new(salt, secret.encode(), hashlib.sha256).hexdigest()
+        return {"salt": salt.hex(), "hash": digest}
+
+    @classmethod
+    def verify_secret(cls, secret, record):
+        if not isinstance(record, dict) or "salt" not in record or "hash" not in record:
+            return False
+        return hmac.compare_digest(cls.hash_secret(secret, record["salt"])["hash"], record["hash"])
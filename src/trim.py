@@ -0,0 +1,174 @@
+import re
+import time
+import threading
+import subprocess
+from datetime import datetime
+
+from shell import Shell
+
+def parse_window(window):
+    """'HH:MM-HH:MM' -> (начало, конец) в минутах от полуночи. Пустая строка - в любое время"""
+    if not window:
+        return None
+    match = re.match(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$', window.strip())
+    if not match:
+        raise ValueError(f"Invalid time window '{window}'. Expected format like '01:00-05:00'")
+    start_h, start_m, end_h, end_m = map(int, match.groups())
+    return start_h * 60 + start_m, end_h * 60 + end_m
+
+class TrimScheduler(Shell):
+    """Периодический fstrim смонтированных шар.
+
+    Освобожденные в файловой системе блоки возвращаются хосту (loop-устройство
+    пробивает дыры в файле образа). Шары обрабатываются по одной и только
+    во временном окне вне часов пиковой нагрузки.
+
+    Блокировка дисков приложения на время fstrim не удерживается: перед
+    отмонтированием шары вызывается exclude(), прерывающий ее обработку.
+    """
+    def __init__(self, interval=86400, window="01:00-06:00", debug=False):
+        self.moduleName = "TrimScheduler"
+        self.debug = debug
+        self.interval = interval
+        self.window = parse_window(window)
+        self.lock = threading.Lock()
+        self._shares = {}
+        self._last_trim = {}
+        # Удерживается на время обработки шары _current, процесс fstrim - _proc
+        self._trim_lock = threading.Lock()
+        self._current = None
+        self._proc = None
+        # Освобождено последним fstrim и всего с запуска (байт)
+        self.reclaimed = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def trim_enabled(share_conf):
+        # Место выделенного заранее образа (full, falloc) не должно освобождаться
+        return share_conf.get("trim", share_conf.get("preallocation", "full") == "sparse")
+
+    def update(self, shares, disks):
+        """Обновление списка шар (при запуске и перезагрузке конфига)"""
+        with self.lock:
+            self._shares = {key: disks[key] for key, share_conf in shares.items() if key in disks and self.trim_enabled(share_conf)}
+
+    def exclude(self, keys, timeout=None):
+        """Исключение шар перед их отмонтированием: идущий fstrim этих шар
+        прерывается. Возвращает False, если он не завершился за timeout"""
+        with self.lock:
+            for key in keys:
+                self._shares.pop(key, None)
+            if self._current not in keys:
+                return True
+            self._current = None
+            if self._proc is not None:
+                self._proc.kill()
+
+        if not self._trim_lock.acquire(timeout=-1 if timeout is None else timeout):
+            return False
+        self._trim_lock.release()
+        return True
+
+    def in_window(self, now=None):
+        if self.window is None:
+            return True
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        start, end = self.window
+        if start <= end:
+            return start <= minute < end
+        # Окно через полночь, например 23:00-04:00
+        return minute >= start or minute < end
+
+    @staticmethod
+    def _allocated_bytes(disk):
+        return disk.get_disk_info()["allocated_mb"] * 1024 * 1024
+
+    def trim(self, key, disk):
+        """fstrim всех точек монтирования шары. Возвращает освобожденное на хосте место (байт)"""
+        disk._invalidate_disk_info()
+        before = self._allocated_bytes(disk)
+        started = time.monotonic()
+        for mount_point in disk.get_mount_points():
+            self._fstrim(mount_point)
+        disk._invalidate_disk_info()
+        reclaimed = max(0, before - self._allocated_bytes(disk))
+
+        stats = self.reclaimed.setdefault(key, {"last": 0, "total": 0, "timestamp": 0.0})
+        stats["last"] = reclaimed
+        stats["total"] += reclaimed
+        stats["timestamp"] = time.time()
+        print(f"Trimmed share '{key}' in {time.monotonic() - started:.1f}s, reclaimed {reclaimed / 1024 ** 2:.1f} MB on the host")
+        return reclaimed
+
+    def _fstrim(self, mount_point):
+        """fstrim с возможностью прерывания из exclude() и stop()"""
+        command = ["fstrim", mount_point]
+        output = None if self.debug else subprocess.DEVNULL
+        with self._heavy_slot(command):
+            started = time.monotonic()
+            with self.lock:
+                if self._current is None:
+                    raise RuntimeError("trim cancelled")
+                self._proc = subprocess.Popen(command, stdout=output, stderr=output)
+            returncode = None
+            try:
+                returncode = self._proc.wait()
+            finally:
+                with self.lock:
+                    self._proc = None
+                self._record(command, started, returncode)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    def _next_due(self):
+        """Шара, которую пора обработать, или None"""
+        now = time.monotonic()
+        with self.lock:
+            for key, disk in self._shares.items():
+                last = self._last_trim.get(key)
+                if last is None or now - last >= self.interval:
+                    return key, disk
+        return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            due = self._next_due() if self.in_window() else None
+            if due is None:
+                self._stop.wait(60)
+                continue
+
+            key, disk = due
+            with self.lock:
+                # Шара могла быть исключена после выбора
+                if self._shares.get(key) is not disk or self._stop.is_set():
+                    continue
+                self._trim_lock.acquire()
+                self._current = key
+            try:
+                self.trim(key, disk)
+            except Exception as e:
+                print(f"Failed to trim share '{key}': {e}")
+            finally:
+                with self.lock:
+                    self._current = None
+                    self._last_trim[key] = time.monotonic()
+                self._trim_lock.release()
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="trim-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Остановка с прерыванием идущего fstrim"""
+        self._stop.set()
+        with self.lock:
+            self._current = None
+            if self._proc is not None:
+                self._proc.kill()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
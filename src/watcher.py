@@ -0,0 +1,74 @@
+import os
+import asyncio
+import threading
+
+class ConfigWatcher:
+    """Отслеживание изменений файла конфигурации по mtime/размеру/inode"""
+    def __init__(self, filename, callback, interval=5):
+        self.filename = filename
+        self.callback = callback
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._signature = self._get_signature()
+
+    def _get_signature(self):
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            signature = self._get_signature()
+            if signature is None or signature == self._signature:
+                continue
+
+            # Ждем, пока редактор закончит запись файла
+            while not self._stop.wait(min(self.interval, 1)):
+                current = self._get_signature()
+                if current == signature:
+                    break
+                signature = current
+
+            self._signature = signature
+            try:
+                self.callback()
+            except Exception as e:
+                print(f"Error applying configuration: {e}")
+
+    async def run_async(self):
+        """Вариант для цикла событий: применение конфигурации выполняется в пуле потоков"""
+        if self.interval <= 0:
+            return
+        while not self._stop.is_set():
+            await asyncio.sleep(self.interval)
+            signature = self._get_signature()
+            if signature is None or signature == self._signature:
+                continue
+
+            while True:
+                await asyncio.sleep(min(self.interval, 1))
+                current = self._get_signature()
+                if current == signature:
+                    break
+                signature = current
+
+            self._signature = signature
+            try:
+                await asyncio.to_thread(self.callback)
+            except Exception as e:
+                print(f"Error applying configuration: {e}")
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None